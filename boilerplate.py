@@ -0,0 +1,156 @@
+import random
+import re
+import sqlite3
+import struct
+import zlib
+from pathlib import Path
+
+
+# Finds boilerplate (licence blocks, transcriber's notes, publisher blurbs) as paragraphs
+# that turn up, word for word or nearly, in more than one book of the library.
+#
+# Every paragraph gets a MinHash signature of its 5-word shingles. Signatures are split
+# into bands and each band is hashed into a bucket (LSH), so a lookup only compares a
+# paragraph with the few paragraphs that share a bucket, not with the whole library.
+# The index is kept in <folder>/.cache/boilerplate.db (SQLite, bands indexed), so a lookup
+# reads only its buckets' rows, and it grows as books are chunked.
+#
+# A book is known by its file name, so a renamed copy or another edition of a book would
+# look like a second book with the same text. The paragraphs a book shares are grouped by
+# exactly which other books have them: a group found in one other book that makes up more
+# than SAME_WORK of the smaller of the two, or one found in several books that makes up
+# more than SAME_WORK of each of them, means those books are the same work, and they don't
+# count for each other. Text also found in third books (e.g. a licence) doesn't count
+# towards a pair, so a short book that is mostly licence still gets its licence flagged.
+
+NUM_PERM = 64
+BANDS = 16                # 16 bands of 4 rows: paragraphs ~50% alike usually share a bucket
+SHINGLE_WORDS = 5
+MIN_CHARS = 80            # Shorter paragraphs ("CANTO I", "THE END") repeat legitimately
+THRESHOLD = 0.7           # Estimated similarity that counts as the same paragraph
+MIN_BOOKS = 2
+SAME_WORK = 0.5
+
+PRIME = 4294967311        # First prime above 2**32
+_random = random.Random(1)
+PERMUTATIONS = [(_random.randrange(1, PRIME), _random.randrange(0, PRIME)) for _ in range(NUM_PERM)]
+SIGNATURE = struct.Struct(f"<{NUM_PERM}Q")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS paragraphs (
+    key TEXT PRIMARY KEY, signature BLOB
+);
+CREATE TABLE IF NOT EXISTS books (
+    key TEXT, book TEXT,
+    PRIMARY KEY (key, book)
+);
+CREATE INDEX IF NOT EXISTS books_by_book ON books (book);
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER, key TEXT
+);
+CREATE INDEX IF NOT EXISTS bands_by_band ON bands (band);
+"""
+
+
+def shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def minhash(text):
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles(text)]
+    return [min((a * h + b) % PRIME for h in hashes) for a, b in PERMUTATIONS]
+
+def band_keys(signature):
+    rows = NUM_PERM // BANDS
+    return [band << 32 | zlib.crc32(repr(signature[band * rows:(band + 1) * rows]).encode()) for band in range(BANDS)]
+
+def similarity(a, b):
+    # Estimated Jaccard similarity of the two paragraphs' shingles
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+def paragraph_key(text):
+    return f"{zlib.crc32(text.encode('utf-8')):08x}{len(text):x}"
+
+
+class BoilerplateIndex:
+    def __init__(self, db_path = ":memory:"):
+        self.db = sqlite3.connect(str(db_path))
+        self.db.executescript(SCHEMA)
+
+    def signature(self, key):
+        row = self.db.execute("SELECT signature FROM paragraphs WHERE key = ?", (key,)).fetchone()
+        return list(SIGNATURE.unpack(row[0])) if row else None
+
+    def book_size(self, book):
+        # Number of (long enough) paragraphs of a book
+        return self.db.execute("SELECT COUNT(*) FROM books WHERE book = ?", (book,)).fetchone()[0]
+
+    def add(self, text, book):
+        """
+        Records that book contains this paragraph.
+        """
+        if len(text) < MIN_CHARS:
+            return
+        key = paragraph_key(text)
+        if not self.db.execute("SELECT 1 FROM paragraphs WHERE key = ?", (key,)).fetchone():
+            signature = minhash(text)
+            self.db.execute("INSERT INTO paragraphs VALUES (?, ?)", (key, SIGNATURE.pack(*signature)))
+            self.db.executemany("INSERT INTO bands VALUES (?, ?)", [(band, key) for band in band_keys(signature)])
+        self.db.execute("INSERT OR IGNORE INTO books VALUES (?, ?)", (key, book))
+
+    def books_with(self, text):
+        """
+        The books that contain this paragraph or a near-duplicate of it.
+        """
+        if len(text) < MIN_CHARS:
+            return set()
+        key = paragraph_key(text)
+        signature = self.signature(key) or minhash(text)
+
+        bands = band_keys(signature)
+        candidates = {row[0] for row in self.db.execute(
+            f"SELECT key FROM bands WHERE band IN ({','.join('?' * len(bands))})", bands)}
+        matches = [key] + [other for other in candidates - {key} if similarity(signature, self.signature(other)) >= THRESHOLD]
+        return {row[0] for row in self.db.execute(
+            f"SELECT DISTINCT book FROM books WHERE key IN ({','.join('?' * len(matches))})", matches)}
+
+    def boilerplate(self, paragraphs, book):
+        """
+        The paragraphs of a book (already added) that are boilerplate: found in other books,
+        not counting copies or other editions of this one.
+        """
+        found = {text: frozenset(self.books_with(text) - {book}) for text in set(paragraphs)}
+        groups = {}   # other books -> number of paragraphs found in exactly those books
+        for books in found.values():
+            if books:
+                groups[books] = groups.get(books, 0) + 1
+        sizes = {other: self.book_size(other) for other in set().union(*groups) | {book}}
+
+        same_work = set()
+        for books, n in groups.items():
+            group_sizes = [sizes[other] for other in books | {book}]
+            if n > SAME_WORK * (min(group_sizes) if len(books) == 1 else max(group_sizes)):
+                same_work |= books
+        return {text for text, books in found.items() if len(books - same_work) + 1 >= MIN_BOOKS}
+
+    def flag(self, paragraphs, book):
+        """
+        Adds a book's paragraphs and returns the ones that are boilerplate.
+        """
+        for text in paragraphs:
+            self.add(text, book)
+        return self.boilerplate(paragraphs, book)
+
+
+def index_path(source_folder):
+    return Path(source_folder) / ".cache" / "boilerplate.db"
+
+def load_index(source_folder = "user"):
+    path = index_path(source_folder)
+    path.parent.mkdir(parents = True, exist_ok = True)
+    return BoilerplateIndex(path)
+
+def save_index(index, source_folder = "user"):
+    index.db.commit()
@@ -1,141 +1,543 @@
 import re
-import ebooklib
 import json
-from ebooklib import epub
-from bs4 import BeautifulSoup
+import hashlib
+import shutil
 from pathlib import Path
 
-def chunk_epub_for_api(epub_path, max_chars=4000):
+import boilerplate
+import jobfile
+
+# Tags holding the story text
+# (Adjust tags if your specific ebook uses divs instead of p)
+TEXT_TAGS = ['p', 'h1', 'h2', 'blockquote']
+
+def extract_paragraphs(raw_html):
+    """
+    The non-empty text of every story tag in one (X)HTML document.
+    Top-level so it can run in a worker process.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(raw_html, 'html.parser')
+    paragraphs = []
+    for tag in soup.find_all(TEXT_TAGS):
+        text = tag.get_text().strip()
+        if text:
+            paragraphs.append(text)
+    return paragraphs
+
+# --- SENTENCE SPLITTING ---
+# A paragraph longer than max_chars is cut at sentence boundaries (rule-based, no model).
+# The chunk holding the first part gets 'join_next': the whitespace that was cut, so the
+# paragraph is put back together exactly when the chapter is reassembled.
+
+SENTENCE_END = re.compile(r'[.!?…]+[”’"\')\]]*(\s+)')
+ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "st", "prof", "sr", "jr", "vs", "etc", "e.g", "i.e", "cf", "viz", "vol", "ch", "no", "pp", "capt", "col", "gen", "lt", "rev", "mt"}
+
+def split_sentences(text):
+    """
+    Splits text into [(sentence, whitespace after it), ...]; the last one has None.
+    """
+    pieces = []
+    start = 0
+    for m in SENTENCE_END.finditer(text):
+        rest = text[m.end():].lstrip('“‘"\'([')
+        if not rest or not (rest[0].isupper() or rest[0].isdigit()):
+            continue
+        word = text[start:m.start()].split()[-1:] or [""]
+        word = word[0].lower().lstrip('“‘"\'([')
+        # "Mr. Smith", "J. R. R. Tolkien"
+        if word in ABBREVIATIONS or (len(word) == 1 and word.isalpha()):
+            continue
+        pieces.append((text[start:m.start(1)], m.group(1)))
+        start = m.end()
+    pieces.append((text[start:], None))
+    return pieces
+
+def split_paragraph(text, max_chars):
+    """
+    Packs a paragraph's sentences into pieces of up to max_chars.
+    Returns [(piece, whitespace to join it to the next piece), ...], None after the last.
+    A sentence that is too long on its own is cut between words, at the last run of
+    whitespace starting within max_chars (the whole run is kept as the join).
+    """
+    sentences = []
+    for sentence, sep in split_sentences(text):
+        while len(sentence) > max_chars:
+            cut = None
+            for m in re.finditer(r'\s+', sentence):
+                if m.start() > max_chars:
+                    break
+                if m.start() > 0:
+                    cut = m
+            if cut is None:
+                # One enormous "word": cut it anyway
+                sentences.append((sentence[:max_chars], ""))
+                sentence = sentence[max_chars:]
+            else:
+                sentences.append((sentence[:cut.start()], cut.group()))
+                sentence = sentence[cut.end():]
+        sentences.append((sentence, sep))
+
+    pieces = []
+    current, current_sep = "", None
+    for sentence, sep in sentences:
+        if current and len(current) + len(current_sep) + len(sentence) > max_chars:
+            pieces.append((current, current_sep))
+            current = sentence
+        else:
+            current = current + current_sep + sentence if current else sentence
+        current_sep = sep
+    pieces.append((current, None))
+    return pieces
+
+def chunk_paragraphs(file_name, paragraphs, max_chars=4000, verbatim=None):
+    """
+    Packs one chapter's paragraphs into chunks of up to max_chars.
+    A paragraph longer than max_chars is split over several chunks (see split_paragraph).
+    verbatim: paragraphs (e.g. boilerplate) to put in chunks of their own, marked 'verbatim'.
+    """
+    chunks = []
+    current_chunk = []
+    current_length = 0
+    
+    for paragraph in paragraphs:
+        if verbatim and paragraph in verbatim:
+            # Copied through as it is: close the current chunk and start a verbatim one
+            if current_chunk:
+                chunks.append({
+                    'file_name': file_name,
+                    'text': "\n\n".join(current_chunk)
+                })
+                current_chunk = []
+                current_length = 0
+            if chunks and chunks[-1].get('verbatim'):
+                chunks[-1]['text'] += "\n\n" + paragraph
+            else:
+                chunks.append({'file_name': file_name, 'text': paragraph, 'verbatim': True})
+            continue
+
+        pieces = split_paragraph(paragraph, max_chars) if len(paragraph) > max_chars else [(paragraph, None)]
+        for text, join_next in pieces:
+            para_len = len(text)
+            
+            # Check limit
+            if current_length + para_len > max_chars and current_chunk:
+                # Save current chunk with metadata
+                chunks.append({
+                    'file_name': file_name,  # CRITICAL: Remembers "chapter1.html"
+                    'text': "\n\n".join(current_chunk)
+                })
+                # Reset
+                current_chunk = [text]
+                current_length = para_len
+            else:
+                current_chunk.append(text)
+                current_length += para_len
+
+            if join_next is not None:
+                # The paragraph goes on in the next chunk
+                chunks.append({
+                    'file_name': file_name,
+                    'text': "\n\n".join(current_chunk),
+                    'join_next': join_next
+                })
+                current_chunk = []
+                current_length = 0
+    
+    # Don't forget the leftovers in this chapter
+    if current_chunk:
+        chunks.append({
+            'file_name': file_name,
+            'text': "\n\n".join(current_chunk)
+        })
+    return chunks
+
+def join_chunks(texts, join_next):
+    """
+    Reassembles consecutive chunk texts of one chapter. join_next[i] is the i-th chunk's
+    join marker (None between whole paragraphs). Returns the chapter's paragraphs.
+    The texts are joined as they are, so the originals come back exactly.
+    """
+    paragraphs = []
+    continues = None
+    for text, sep in zip(texts, join_next):
+        parts = text.split("\n\n")
+        if continues is not None and paragraphs:
+            paragraphs[-1] = paragraphs[-1] + continues + parts.pop(0)
+        paragraphs.extend(parts)
+        continues = sep
+    return paragraphs
+
+def chapter_texts(job_data, lang = None):
+    """
+    Groups the chunk texts by chapter file, falling back to the original where a chunk
+    hasn't been woven yet, and joins paragraphs that were split over chunks.
+    {'chap01.xhtml': "Paragraph 1\n\nParagraph 2...", ...}
+    """
+    chapter_map = {}
+    for item in job_data:
+        woven = job_slot(item, lang).get('translated_text')
+        # The model may add whitespace around its answer; the original is used as it is
+        text = woven.strip() if woven else item['original_text']
+        texts, joins = chapter_map.setdefault(item['source_file'], ([], []))
+        texts.append(text)
+        joins.append(item.get('join_next'))
+    return {name: "\n\n".join(join_chunks(texts, joins)) for name, (texts, joins) in chapter_map.items()}
+
+def document_items(epub_path):
+    """
+    (file name, raw bytes) of every HTML document (chapter) in an EPUB.
+    """
+    # Heavy imports are only paid for when an EPUB is actually read
+    import ebooklib
+    from ebooklib import epub
+
+    book = epub.read_epub(epub_path)
+    return [(item.get_name(), item.content) for item in book.get_items() if item.get_type() == ebooklib.ITEM_DOCUMENT]
+
+# --- EXTRACTION CACHE ---
+# Extracted paragraphs are stored per document, keyed by a hash of its bytes and of the
+# extraction rules, so an unchanged book is never parsed twice.
+
+def cache_key(raw):
+    return hashlib.sha1(repr(TEXT_TAGS).encode("utf-8") + raw).hexdigest()
+
+def read_cache(cache_dir, key):
+    path = Path(cache_dir) / f"{key}.json"
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return None
+
+def write_cache(cache_dir, key, paragraphs):
+    Path(cache_dir).mkdir(parents = True, exist_ok = True)
+    with open(Path(cache_dir) / f"{key}.json", "w", encoding="utf-8") as f:
+        json.dump(paragraphs, f, ensure_ascii = False)
+
+def chunk_epub_for_api(epub_path, max_chars=4000, cache_dir=None, boilerplate_index=None):
     """
     Reads an EPUB, extracts text from chapters, and chunks it.
     Returns a list of dicts: {'file_name': 'chap1.xhtml', 'text': '...'}
+    cache_dir: reuse (and store) extracted paragraphs there.
+    boilerplate_index: a boilerplate.BoilerplateIndex; the book is added to it, and paragraphs
+    also found in other books become verbatim chunks.
     """
-    book = epub.read_epub(epub_path)
     all_chunks_for_api = []
+    documents = []
 
-    # 1. Iterate through every file in the book
-    for item in book.get_items():
+    # 1. Iterate through every HTML document (Chapter) in the book
+    for name, raw in document_items(epub_path):
         
-        # We only care about HTML documents (Chapters)
-        if item.get_type() == ebooklib.ITEM_DOCUMENT:
-            
-            # 2. Extract raw HTML
-            raw_html = item.get_content().decode('utf-8')
-            soup = BeautifulSoup(raw_html, 'html.parser')
-            
-            # 3. Find specific story text
-            # (Adjust tags if your specific ebook uses divs instead of p)
-            paragraphs = soup.find_all(['p', 'h1', 'h2', 'blockquote'])
-            
-            # --- START CHUNKING LOGIC (Per Chapter) ---
-            current_chunk = []
-            current_length = 0
-            
-            for tag in paragraphs:
-                text = tag.get_text().strip()
-                if not text: continue
-                
-                para_len = len(text)
-                
-                # Check limit
-                if current_length + para_len > max_chars:
-                    # Save current chunk with metadata
-                    all_chunks_for_api.append({
-                        'file_name': item.get_name(),  # CRITICAL: Remembers "chapter1.html"
-                        'text': "\n\n".join(current_chunk)
-                    })
-                    # Reset
-                    current_chunk = [text]
-                    current_length = para_len
-                else:
-                    current_chunk.append(text)
-                    current_length += para_len
-            
-            # Don't forget the leftovers in this chapter
-            if current_chunk:
-                all_chunks_for_api.append({
-                    'file_name': item.get_name(),
-                    'text': "\n\n".join(current_chunk)
-                })
+        # 2. Extract the story text, from the cache if possible
+        paragraphs = None
+        if cache_dir:
+            key = cache_key(raw)
+            paragraphs = read_cache(cache_dir, key)
+        if paragraphs is None:
+            paragraphs = extract_paragraphs(raw)
+            if cache_dir:
+                write_cache(cache_dir, key, paragraphs)
+        documents.append((name, paragraphs))
+
+    # 3. Chunk it (per chapter); boilerplate is looked for in the whole book at once
+    verbatim = None
+    if boilerplate_index:
+        verbatim = boilerplate_index.flag([text for _, paragraphs in documents for text in paragraphs], Path(epub_path).stem)
+    for name, paragraphs in documents:
+        all_chunks_for_api.extend(chunk_paragraphs(name, paragraphs, max_chars, verbatim))
                 
     return all_chunks_for_api
 
+def ingest_library(source_folder = "user", max_chars = 4000, workers = None, cache_dir = None):
+    """
+    Chunks every EPUB in a folder into its chunked_<book>.json job.
+    Documents that aren't in the cache yet are extracted in a process pool (across all
+    books at once), so re-ingesting an unchanged library only reads the cache.
+    An existing job is migrated rather than overwritten.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    cache_dir = cache_dir or Path(source_folder) / ".cache" / "paragraphs"
+    books = sorted(Path(source_folder).glob("*.epub"))
+
+    # 1. Read every book and look its documents up in the cache
+    documents = {}   # book -> [(name, key)]
+    extracted = {}   # key -> paragraphs
+    todo = {}        # key -> raw bytes, for the cache misses
+    for book_path in books:
+        documents[book_path] = []
+        for name, raw in document_items(book_path):
+            key = cache_key(raw)
+            documents[book_path].append((name, key))
+            if key not in extracted and key not in todo:
+                cached = read_cache(cache_dir, key)
+                if cached is None:
+                    todo[key] = raw
+                else:
+                    extracted[key] = cached
+    print(f"{len(books)} books, {len(extracted)} documents cached, {len(todo)} to extract")
+
+    # 2. Extract the misses in parallel
+    if todo:
+        keys = list(todo)
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            for key, paragraphs in zip(keys, pool.map(extract_paragraphs, [todo[k] for k in keys], chunksize = 8)):
+                extracted[key] = paragraphs
+                write_cache(cache_dir, key, paragraphs)
+
+    # 3. Add every book to the boilerplate index before flagging any of them
+    index = boilerplate.load_index(source_folder)
+    for book_path, docs in documents.items():
+        for name, key in docs:
+            for text in extracted[key]:
+                index.add(text, book_path.stem)
+    boilerplate.save_index(index, source_folder)
+
+    # 4. Chunk and save each book
+    jobs = []
+    for book_path, docs in documents.items():
+        chunks = []
+        verbatim = index.boilerplate([text for _, key in docs for text in extracted[key]], book_path.stem)
+        for name, key in docs:
+            chunks.extend(chunk_paragraphs(name, extracted[key], max_chars, verbatim))
+
+        job_path = job_file_path(source_folder, book_path.stem)
+        new_job = build_job(chunks)
+        if job_path.exists():
+            migrate_job(jobfile.load_job(job_path), new_job)
+        jobfile.save_job(job_path, new_job)
+        verbatim = sum(1 for item in new_job if item.get("verbatim"))
+        print(f"  {book_path.name}: {len(new_job)} chunks ({verbatim} verbatim)")
+        jobs.append(job_path)
+    return jobs
+
 # This will only allow for recombining into one huge text file, no chapters or similar
-def chunk_txt_safely(text, max_chars=10000):
+def chunk_txt_safely(text, max_chars=10000, file_name="text.txt"):
     """
-    Splits text into chunks strictly by paragraph to preserve context.
-    max_chars: Soft limit. We only break it if a SINGLE paragraph is huge.
+    Splits text into chunks by paragraph to preserve context; a paragraph is only
+    broken up (at sentence boundaries) if it is longer than max_chars on its own.
+    Returns chunks like chunk_epub_for_api, ready for save_chunks.
     """
     
     # 1. Split by double newlines (standard paragraph break)
-    # This creates a list of strings, where each string is one paragraph.
-    paragraphs = text.split('\n\n')
+    # Without blank lines the whole text is one paragraph, and gets split into sentences
+    paragraphs = [p.strip() for p in text.split('\n\n')]
     
-    current_chunk = []
-    current_length = 0
-    chunks = []
-    
-    for paragraph in paragraphs:
-        # Clean up whitespace
-        paragraph = paragraph.strip()
-        if not paragraph:
-            continue
-            
-        # Estimated length of this paragraph (chars)
-        para_len = len(paragraph)
-        
-        # 2. Check: Will adding this paragraph overflow the limit?
-        if current_length + para_len > max_chars:
-            # YES: The bucket is full.
-            
-            # A. Save the current bucket as a chunk
-            if current_chunk:
-                chunks.append("\n\n".join(current_chunk))
-            
-            # B. Start a new bucket with the current paragraph
-            current_chunk = [paragraph]
-            current_length = para_len
-        else:
-            # NO: The bucket has room. Add it.
-            current_chunk.append(paragraph)
-            current_length += para_len
-            
-    # 3. Don't forget the last bucket!
-    if current_chunk:
-        chunks.append("\n\n".join(current_chunk))
-        
-    return chunks
+    # 2. Pack them like a chapter
+    return chunk_paragraphs(file_name, [p for p in paragraphs if p], max_chars)
 
-def save_chunks(chunks, save_path):
+def job_file_path(source_folder, book_name):
+    """
+    chunked_<book>.json, or chunked_<book>.djob if the job was converted to the binary format.
+    """
+    path = Path(source_folder) / f"chunked_{book_name}{jobfile.BINARY_SUFFIX}"
+    return path if path.exists() else path.with_suffix(".json")
+
+def new_slot():
+    return {
+        "translated_text": None,  # Empty for now
+        "status": "pending",      # Mark as ready to do
+        "new_words": []
+    }
+
+# --- CHUNK IDENTITY ---
+# A chunk's id is a hash of its chapter and of its paragraphs, so the same text gets
+# the same id however the rest of the book is chunked.
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+def paragraph_hashes(text):
+    return [text_hash(p) for p in text.split("\n\n")]
+
+def chunk_id(source_file, text):
+    return text_hash(source_file + "\n" + "\n".join(paragraph_hashes(text)))
+
+def build_job(chunks, languages = None):
+    """
+    Turns the chunker output into job items with content-addressed ids.
+    """
     job_data = []
-    for i, chunk in enumerate(chunks):
+    used = {}
+    for chunk in chunks:
+        cid = chunk_id(chunk['file_name'], chunk['text'])
+        # The same text twice in one chapter: number the repeats
+        used[cid] = used.get(cid, 0) + 1
+        if used[cid] > 1:
+            cid = f"{cid}-{used[cid]}"
         job_item = {
-            "id": i,
+            "id": cid,
             "source_file": chunk['file_name'],
             "original_text": chunk['text'],
             "translated_text": None,  # Empty for now
             "status": "pending"       # Mark as ready to do
         }
+        if chunk.get('verbatim'):
+            # Boilerplate: never sent to the API, compiled from original_text
+            job_item["status"] = "verbatim"
+            job_item["verbatim"] = True
+        if chunk.get('join_next') is not None:
+            job_item["join_next"] = chunk['join_next']   # Last paragraph continues in the next chunk
         job_data.append(job_item)
+    if languages:
+        add_languages(job_data, languages)
+    return job_data
+
+def save_chunks(chunks, save_path, languages = None):
+    """
+    languages: for a multi-language job, e.g. ["Italian", "Russian"]. Each chunk then
+    gets a 'languages' dict with one translation slot per language.
+    """
+    job_data = build_job(chunks, languages)
+
+    # 3. Save the Job File (.json or .djob, see jobfile.py)
+    jobfile.save_job(save_path, job_data)
+
+# --- MULTI-LANGUAGE JOBS ---
+# A single-language job keeps translated_text/status on the chunk itself.
+# A multi-language job also has item["languages"][lang] = {translated_text, status, new_words}.
+
+def add_languages(job_data, languages):
+    """
+    Adds an empty translation slot for every language a chunk doesn't have yet.
+    """
+    for item in job_data:
+        slots = item.setdefault("languages", {})
+        for lang in languages:
+            if lang not in slots:
+                slots[lang] = new_slot()
+                if item.get("verbatim"):
+                    slots[lang]["status"] = "verbatim"
+
+def job_slot(item, lang = None):
+    """
+    The part of a chunk holding translated_text and status for a language.
+    """
+    if lang is None or "languages" not in item:
+        return item
+    return item["languages"][lang]
+
+def job_languages(job_data):
+    # Languages of a multi-language job ([] for a single-language job)
+    if job_data and "languages" in job_data[0]:
+        return list(job_data[0]["languages"])
+    return []
+
+def vocab_filename(lang = None):
+    # Each language of a multi-language job has its own known words
+    return f"known_words_{lang}.json" if lang else "known_words.json"
+
+def ensure_vocab_file(folder, lang = None):
+    """
+    Creates an empty vocabulary file for a language that has none yet.
+    """
+    vocab_path = Path(folder) / vocab_filename(lang)
+    if not vocab_path.exists():
+        vocab_path.write_text("[]", encoding="utf-8")
+
+
+# --- RE-CHUNKING ---
+
+def paragraph_translations(job_data, lang = None):
+    """
+    Maps paragraph hash -> woven paragraph, from the completed chunks whose woven text
+    has as many paragraphs as the original (the prompt asks the model to keep them).
+    """
+    translations = {}
+    for item in job_data:
+        slot = job_slot(item, lang)
+        if slot["status"] != "completed" or not slot.get("translated_text"):
+            continue
+        originals = item["original_text"].split("\n\n")
+        woven = slot["translated_text"].split("\n\n")
+        if len(originals) == len(woven):
+            for original, text in zip(originals, woven):
+                translations[text_hash(original)] = text
+    return translations
+
+def migrate_job(old_job, new_job):
+    """
+    Carries finished work from an old job into a freshly chunked one.
+    - A chunk with the same id keeps everything it had.
+    - A changed chunk whose paragraphs were all woven before is rebuilt from them.
+    - Anything else stays pending.
+    Returns the counts {'kept': n, 'rebuilt': n, 'pending': n} (per language slot).
+    """
+    old_by_id = {item["id"]: item for item in old_job}
+    languages = job_languages(old_job)
+    if languages:
+        add_languages(new_job, languages)
+    slots = languages or [None]
+    translations = {lang: paragraph_translations(old_job, lang) for lang in slots}
+
+    counts = {"kept": 0, "rebuilt": 0, "pending": 0}
+    for item in new_job:
+        if item.get("verbatim"):
+            continue   # Nothing to carry over: it is copied through
+        old = old_by_id.get(item["id"])
+        for lang in slots:
+            slot = job_slot(item, lang)
+            if old is not None:
+                old_slot = job_slot(old, lang)
+                for key in ("translated_text", "status", "new_words", "partial_text"):
+                    if key in old_slot:
+                        slot[key] = old_slot[key]
+                counts["kept"] += 1
+                continue
+
+            woven = [translations[lang].get(h) for h in paragraph_hashes(item["original_text"])]
+            if all(woven):
+                slot["translated_text"] = "\n\n".join(woven)
+                slot["status"] = "completed"
+                counts["rebuilt"] += 1
+            else:
+                counts["pending"] += 1
+    return counts
+
+def rechunk(
+    source_folder = "user",
+    book_name = "Dante - The Divine Comedy",
+    file_name = "Dante - The Divine Comedy.epub",
+    max_chars = 4000
+):
+    """
+    Re-chunks a book (e.g. with a new max_chars) and migrates its existing job,
+    so only the chunks whose text changed have to be woven again.
+    The old job is kept as a .bak file.
+    """
+    job_path = job_file_path(source_folder, book_name)
+    old_job = jobfile.load_job(job_path)
 
-    # 3. Save the Job File
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(job_data, f, indent=2)
+    index = boilerplate.load_index(source_folder)
+    new_job = build_job(chunk_epub_for_api(Path(source_folder) / file_name, max_chars = max_chars, boilerplate_index = index))
+    boilerplate.save_index(index, source_folder)
+    counts = migrate_job(old_job, new_job)
+    print(f"{len(old_job)} chunks -> {len(new_job)} chunks: "
+          f"{counts['kept']} kept, {counts['rebuilt']} rebuilt from woven paragraphs, {counts['pending']} pending")
 
+    shutil.copyfile(job_path, job_path.with_name(job_path.name + ".bak"))
+    jobfile.save_job(job_path, new_job)
+    return counts
 
 def chunker(
     source_folder = "user",
     book_name = "Dante - The Divine Comedy",
-    file_name = "Dante - The Divine Comedy.epub"
+    file_name = "Dante - The Divine Comedy.epub",
+    max_chars = 4000,
+    languages = None
 ):
     
     path = Path(source_folder) / file_name
 
-    all_chunks = chunk_epub_for_api(path)
+    index = boilerplate.load_index(source_folder)
+    all_chunks = chunk_epub_for_api(path, max_chars = max_chars, boilerplate_index = index)
+    boilerplate.save_index(index, source_folder)
     print(f"Total chunks found: {len(all_chunks)}\n")
 
-    new_path = Path(source_folder) / f"chunked_{book_name}.json"
-    save_chunks(all_chunks, new_path)
+    new_path = job_file_path(source_folder, book_name)
+    save_chunks(all_chunks, new_path, languages = languages)
+    return new_path
 
 def main():
     
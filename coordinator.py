@@ -0,0 +1,303 @@
+import json
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import chunker
+import jobfile
+
+
+# Lease-based coordination, so several processes (or machines sharing the folder) can
+# weave the same jobs without rewriting each other's job files.
+#
+# The job's pending chunks are copied into an SQLite database. A worker leases one chunk
+# for lease_seconds, keeps the lease alive with heartbeats while the LLM call runs, and
+# commits the woven text and the new words in one transaction. A lease that isn't renewed
+# (the worker crashed or lost its connection) expires and the chunk goes back in the queue.
+# 'collect' writes the results back into the job file and the vocabulary files.
+#
+# Vocabulary grows chunk by chunk, so by default only one chunk per vocabulary file is
+# leased at a time: workers scale across languages and books. in_flight > 1 also spreads a
+# vocabulary over several workers, at the cost of chunks being woven with the same words.
+#
+# NOTE: on a network filesystem SQLite is only as safe as the filesystem's file locking.
+
+DB_FILE = "coordinator.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job TEXT, lang TEXT, multi INTEGER,
+    PRIMARY KEY (job, lang)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    job TEXT, lang TEXT, vocab TEXT, position INTEGER, priority INTEGER, id TEXT, source_file TEXT, original_text TEXT,
+    status TEXT, translated_text TEXT, new_words TEXT,
+    lease_id TEXT, lease_owner TEXT, lease_expires REAL, attempts INTEGER DEFAULT 0, error TEXT,
+    PRIMARY KEY (job, lang, id)
+);
+CREATE INDEX IF NOT EXISTS chunks_by_status ON chunks (status, vocab, job, priority);
+CREATE TABLE IF NOT EXISTS known_words (
+    vocab TEXT, lemma TEXT, chunk_id TEXT,
+    PRIMARY KEY (vocab, lemma)
+);
+"""
+
+
+def connect(db_path):
+    # Autocommit mode: every write below opens its own BEGIN IMMEDIATE transaction
+    db = sqlite3.connect(db_path, timeout = 60, isolation_level = None)
+    db.row_factory = sqlite3.Row
+    db.executescript(SCHEMA)
+    return db
+
+def known_words(db, vocab):
+    # vocab: the vocabulary file name, e.g. known_words_Italian.json
+    return [row["lemma"] for row in db.execute("SELECT lemma FROM known_words WHERE vocab = ? ORDER BY rowid", (vocab,))]
+
+def queue_job(db, job_file, folder = "user", languages = ("Italian",), position = None, window = 10):
+    """
+    Adds the chunks of a job to the queue (chunks already queued are left alone).
+    A vocabulary file seeds its known words the first time it is seen.
+    position, window: lease the reader's read-ahead window first (see scheduler.reading_order).
+    Queueing a job again with a new position re-prioritises it.
+    """
+    import scheduler
+
+    job_data = jobfile.load_job(Path(folder) / job_file)
+    ahead, backfill = scheduler.reading_order(job_data, position, window)
+    priority = {str(item["id"]): rank for rank, item in enumerate(ahead + backfill)}
+    multi = bool(chunker.job_languages(job_data))
+    if multi:
+        chunker.add_languages(job_data, languages)
+    elif len(languages) > 1:
+        raise ValueError(f"{job_file} is a single-language job; chunk it with several --lang to weave more")
+
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for lang in languages:
+            vocab = chunker.vocab_filename(lang if multi else None)
+            db.execute("INSERT OR IGNORE INTO jobs VALUES (?, ?, ?)", (job_file, lang, int(multi)))
+            for index, item in enumerate(job_data):
+                slot = chunker.job_slot(item, lang if multi else None)
+                db.execute(
+                    "INSERT OR IGNORE INTO chunks (job, lang, vocab, position, id, source_file, original_text, status, translated_text, new_words) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_file, lang, vocab, index, str(item["id"]), item["source_file"], item["original_text"],
+                     slot["status"], slot.get("translated_text"), json.dumps(slot.get("new_words", []), ensure_ascii = False))
+                )
+                db.execute("UPDATE chunks SET priority = ? WHERE job = ? AND lang = ? AND id = ?",
+                           (priority[str(item["id"])], job_file, lang, str(item["id"])))
+            if not db.execute("SELECT 1 FROM known_words WHERE vocab = ? LIMIT 1", (vocab,)).fetchone():
+                vocab_path = Path(folder) / vocab
+                if vocab_path.exists():
+                    with open(vocab_path, "r", encoding="utf-8") as f:
+                        for lemma in json.load(f):
+                            db.execute("INSERT OR IGNORE INTO known_words (vocab, lemma) VALUES (?, ?)", (vocab, lemma))
+        db.execute("COMMIT")
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+
+def lease(db, worker, lease_seconds = 600, in_flight = 1):
+    """
+    Leases the next pending chunk, in reading order, of a vocabulary with fewer than
+    in_flight chunks out. Expired leases are re-queued first. Returns the chunk row as a dict, or None.
+    """
+    now = time.time()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        db.execute("UPDATE chunks SET status = 'pending', lease_id = NULL, lease_owner = NULL "
+                   "WHERE status = 'leased' AND lease_expires < ?", (now,))
+        row = db.execute(
+            "SELECT * FROM chunks AS c WHERE status = 'pending' AND "
+            "(SELECT COUNT(*) FROM chunks WHERE status = 'leased' AND vocab = c.vocab) < ? "
+            "ORDER BY vocab, job, priority LIMIT 1", (in_flight,)
+        ).fetchone()
+        if row is None:
+            db.execute("COMMIT")
+            return None
+        lease_id = uuid.uuid4().hex
+        db.execute("UPDATE chunks SET status = 'leased', lease_id = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                   "WHERE job = ? AND lang = ? AND id = ?", (lease_id, worker, now + lease_seconds, row["job"], row["lang"], row["id"]))
+        db.execute("COMMIT")
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    chunk = dict(row)
+    chunk["lease_id"] = lease_id
+    return chunk
+
+def heartbeat(db, lease_id, lease_seconds = 600):
+    """
+    Extends a lease. Returns False if it was lost (expired and taken by another worker).
+    """
+    cursor = db.execute("UPDATE chunks SET lease_expires = ? WHERE lease_id = ? AND status = 'leased'",
+                        (time.time() + lease_seconds, lease_id))
+    return cursor.rowcount == 1
+
+def complete(db, chunk, translated_text, new_words):
+    """
+    Stores a woven chunk and its new words in one transaction. Returns False (and stores
+    nothing) if the lease was lost, because the chunk is then another worker's.
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = db.execute(
+            "UPDATE chunks SET status = 'completed', translated_text = ?, new_words = ?, lease_id = NULL, error = NULL "
+            "WHERE lease_id = ? AND status = 'leased'",
+            (translated_text, json.dumps(new_words, ensure_ascii = False), chunk["lease_id"])
+        )
+        if cursor.rowcount != 1:
+            db.execute("ROLLBACK")
+            return False
+        for lemma in new_words:
+            db.execute("INSERT OR IGNORE INTO known_words VALUES (?, ?, ?)", (chunk["vocab"], lemma, chunk["id"]))
+        db.execute("COMMIT")
+        return True
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+
+def release(db, chunk, error, max_attempts = 3):
+    """
+    Gives a chunk back after an error; it fails for good after max_attempts leases.
+    """
+    db.execute("UPDATE chunks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+               "lease_id = NULL, lease_owner = NULL, error = ? WHERE lease_id = ? AND status = 'leased'",
+               (max_attempts, str(error), chunk["lease_id"]))
+
+def queue_status(db):
+    """
+    {(job, lang): {status: count}}
+    """
+    counts = {}
+    for row in db.execute("SELECT job, lang, status, COUNT(*) AS n FROM chunks GROUP BY job, lang, status"):
+        counts.setdefault((row["job"], row["lang"]), {})[row["status"]] = row["n"]
+    return counts
+
+def collect(db, job_file, folder = "user"):
+    """
+    Writes the completed chunks back into the job file, and each language's known words
+    into its vocabulary file. Returns the number of chunks written.
+    """
+    path = Path(folder) / job_file
+    job_data = jobfile.load_job(path)
+    by_id = {str(item["id"]): item for item in job_data}
+
+    written = 0
+    for job_row in db.execute("SELECT * FROM jobs WHERE job = ?", (job_file,)).fetchall():
+        lang = job_row["lang"] if job_row["multi"] else None
+        if lang:
+            chunker.add_languages(job_data, [lang])
+        rows = db.execute("SELECT id, translated_text, new_words FROM chunks WHERE job = ? AND lang = ? AND status = 'completed'",
+                          (job_file, job_row["lang"])).fetchall()
+        for row in rows:
+            item = by_id.get(row["id"])
+            if item is None:
+                continue   # The job was re-chunked since it was queued
+            slot = chunker.job_slot(item, lang)
+            if slot["status"] != "completed":
+                written += 1
+            slot["translated_text"] = row["translated_text"]
+            slot["status"] = "completed"
+            slot["new_words"] = json.loads(row["new_words"])
+            slot.pop("partial_text", None)
+
+        vocab = chunker.vocab_filename(lang)
+        with open(Path(folder) / vocab, "w", encoding="utf-8") as f:
+            json.dump(known_words(db, vocab), f, ensure_ascii = False, indent = 2)
+
+    jobfile.save_job(path, job_data)
+    return written
+
+
+# --- WORKER ---
+
+class Heartbeat:
+    """
+    Renews a lease in the background until stopped. lost is set if the lease was taken away.
+    """
+    def __init__(self, db_path, lease_id, lease_seconds):
+        self.stopped = threading.Event()
+        self.lost = False
+        self.thread = threading.Thread(target = self.run, args = (db_path, lease_id, lease_seconds), daemon = True)
+        self.thread.start()
+
+    def run(self, db_path, lease_id, lease_seconds):
+        db = connect(db_path)   # sqlite3 connections belong to one thread
+        while not self.stopped.wait(lease_seconds / 3):
+            if not heartbeat(db, lease_id, lease_seconds):
+                self.lost = True
+                break
+        db.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+def run_worker(
+    db_path,
+    folder = "user",
+    worker = None,
+    max_calls = None,
+    lease_seconds = 600,
+    in_flight = 1,
+    poll = 5,
+    client = None,
+    pause = 8,
+    hedger = None,
+    router = None,
+    cache = None
+):
+    """
+    Leases and weaves chunks until the queue is empty (or max_calls chunks are done).
+    While other workers still hold leases it waits, in case one of them expires.
+    """
+    import scheduler
+
+    worker = worker or f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+    db = connect(db_path)
+    # weave() works on files: each worker keeps its vocabulary copy and scratch output apart
+    scratch = Path(folder) / ".workers" / worker
+    scratch.mkdir(parents = True, exist_ok = True)
+
+    done = 0
+    try:
+        while max_calls is None or done < max_calls:
+            chunk = lease(db, worker, lease_seconds, in_flight)
+            if chunk is None:
+                if not db.execute("SELECT 1 FROM chunks WHERE status IN ('pending', 'leased') LIMIT 1").fetchone():
+                    break
+                time.sleep(poll)
+                continue
+
+            print(f"[{worker}] Processing Chunk {chunk['id']} [{chunk['lang']}] of {chunk['job']}...")
+            with open(scratch / chunker.vocab_filename(chunk["lang"]), "w", encoding="utf-8") as f:
+                json.dump(known_words(db, chunk["vocab"]), f, ensure_ascii = False)
+
+            beat = Heartbeat(db_path, chunk["lease_id"], lease_seconds)
+            try:
+                text, new_words = scheduler.weave_chunk(chunk, chunk["lang"], scratch, client, pause, hedger, router, cache)
+            except Exception as e:
+                beat.stop()
+                print(f"[{worker}] Error on Chunk {chunk['id']} [{chunk['lang']}]: {e}")
+                release(db, chunk, e)
+                break # Stop this worker so you can fix the error
+            beat.stop()
+
+            if complete(db, chunk, text, new_words):
+                done += 1
+                print(f"[{worker}] Chunk {chunk['id']} [{chunk['lang']}] committed.")
+            else:
+                print(f"[{worker}] Lease on Chunk {chunk['id']} [{chunk['lang']}] was lost; result dropped.")
+    finally:
+        db.close()
+        shutil.rmtree(scratch, ignore_errors = True)
+
+    scheduler.finish_run(hedger, router, cache)
+    print(f"[{worker}] Finished after {done} chunks.")
+    return done
@@ -2,17 +2,20 @@ from pathlib import Path
 import re
 import html
 import json
+import chunker
+import jobfile
 
 
 class TagReplacer:
-    def __init__(self):
+    def __init__(self, compact=False):
         self.counter = 0
         self.footnotes = []  # Stores the definitions
+        self.compact = compact
+        self.seen = {}  # (lemma, word) -> ref_id, so repeated words share one footnote
+        self.notes = {}  # ref_id -> [definition, lemma], for the JSON footnote index
 
     # This magic method runs when you "call" the class instance
     def __call__(self, match):
-        self.counter += 1
-        ref_id = f"ref_{self.counter}"
         
         # Split the braces to extract word, lemma and definition
         content = match.group(1)
@@ -20,20 +23,53 @@ class TagReplacer:
             word, lemma, definition = content.split('|')
         except ValueError:
             return content
+        word, lemma, definition = word.strip(), lemma.strip(), definition.strip()
+
+        # Compact mode: one footnote per (lemma, surface form) per chapter
+        key = (lemma.lower(), word)
+        if self.compact and key in self.seen:
+            return f'<a href="#{self.seen[key]}" epub:type="noteref" class="ru">{word}</a>'
+
+        self.counter += 1
+        ref_id = f"ref_{self.counter}"
+        self.seen[key] = ref_id
+        self.notes[ref_id] = [definition, lemma]
         
         # Create the footnote 
-        note_html = f"""
+        if self.compact:
+            note_html = (
+                f'<aside id="{ref_id}" epub:type="footnote">'
+                f'<p><strong>{definition}</strong></p><p><em>Base: {lemma}</em></p></aside>'
+            )
+        else:
+            note_html = f"""
         <aside id="{ref_id}" epub:type="footnote">
-            <p><strong>{definition.strip()}</strong></p>
-            <p><em>Base: {lemma.strip()}</em></p>
+            <p><strong>{definition}</strong></p>
+            <p><em>Base: {lemma}</em></p>
         </aside>
         """
         self.footnotes.append(note_html)
         
         # Return the link
-        return f'<a href="#{ref_id}" epub:type="noteref" class="ru">{word.strip()}</a>'
+        return f'<a href="#{ref_id}" epub:type="noteref" class="ru">{word}</a>'
+
 
-def footnoter(source_folder = "user", input_text = ""):
+def minify_markup(markup):
+    """
+    Strips the indentation and blank lines out of generated markup.
+    Only whitespace around block-level tags is removed, so the spaces between
+    inline links and words are left alone.
+    """
+    # Collapse indented line breaks into a single space
+    markup = re.sub(r'\s*\n\s*', ' ', markup)
+    # Drop the space that is left next to block-level tags
+    block = r'(?:p|aside|section|div|head|body|html|title|meta|link|style|h[1-6]|blockquote|br)'
+    markup = re.sub(rf'\s+(</?{block}\b)', r'\1', markup)
+    markup = re.sub(rf'(</?{block}\b[^>]*>)\s+', r'\1', markup)
+    return markup.strip()
+
+
+def footnoter(source_folder = "user", input_text = "", compact = False, replacer = None):
         # 1. Read the mixed text file
         # Ensure encoding is utf-8 to handle the Russian correctly
     if input_text == "":
@@ -42,7 +78,9 @@ def footnoter(source_folder = "user", input_text = ""):
     else:
         text = input_text
     
-    replacer = TagReplacer()
+    # A replacer can be passed in to read its notes afterwards
+    if replacer is None:
+        replacer = TagReplacer(compact = compact)
     
         # 2. Escape HTML special characters
         # This ensures symbols like "&" don't break the ebook reader
@@ -61,11 +99,12 @@ def footnoter(source_folder = "user", input_text = ""):
         if clean_block:
             # Handle poetry line breaks within the stanza
             # We replace single newlines with <br/>
-            formatted_block = clean_block.replace('\n', '<br/>\n')
+            formatted_block = clean_block.replace('\n', '<br/>' if compact else '<br/>\n')
             
             html_parts.append(f"<p>{formatted_block}</p>")
 
-    html_body = "\n".join(html_parts)
+    separator = "" if compact else "\n"
+    html_body = separator.join(html_parts)
 
 
         # 4. Find any Cyrillic character range (a Russian word) and wraps it in a <span class="ru">...</span>
@@ -77,7 +116,7 @@ def footnoter(source_folder = "user", input_text = ""):
     )
 
         # Combine footnotes into one block
-    all_footnotes = "\n".join(replacer.footnotes)
+    all_footnotes = separator.join(replacer.footnotes)
     return html_body, all_footnotes
 
 def output_html(body_text, footnotes, source_folder = "user"):
@@ -208,6 +247,112 @@ def output_html(body_text, footnotes, source_folder = "user"):
     save_path = Path(source_folder) / "html_output.html"
     save_path.write_text(final_html, encoding="utf-8")
 
+# --- BOOK-SCALE READER OUTPUT ---
+# One page per chapter plus one small JSON footnote file per chapter.
+# Pages only hold the text; a footnote file is fetched the first time a word is clicked,
+# so opening a page costs the same however long the book is.
+
+READER_CSS = """body { font-family: serif; line-height: 1.6; max-width: 800px; margin: 0 auto; padding: 20px 20px 200px; }
+p { text-indent: 1.5em; margin: 0; }
+a.ru { color: #3b5998; font-weight: bold; text-decoration: none; cursor: pointer; border-bottom: 1px dotted #3b5998; }
+a.ru:hover { background-color: #eaf2ff; }
+nav { margin: 1em 0; font-family: sans-serif; }
+#popup { position: fixed; bottom: 20px; left: 50%; transform: translateX(-50%); width: 90%; max-width: 400px;
+  background: white; border: 2px solid #3b5998; border-radius: 8px; padding: 15px;
+  box-shadow: 0 4px 15px rgba(0,0,0,0.2); display: none; z-index: 1000; font-family: sans-serif; }
+"""
+
+# A single delegated listener for the whole page. The notes are fetched once, on the first click.
+# (Browsers block fetch() on file:// pages, so serve the folder, e.g. `python -m http.server`.)
+READER_JS = """(function () {
+  var notes = null;
+  var popup = document.getElementById('popup');
+  function loadNotes() {
+    if (!notes) {
+      notes = fetch(document.body.dataset.notes).then(function (r) { return r.json(); });
+    }
+    return notes;
+  }
+  document.addEventListener('click', function (e) {
+    var link = e.target.closest('a.ru');
+    if (!link) {
+      if (!e.target.closest('#popup')) { popup.style.display = 'none'; }
+      return;
+    }
+    e.preventDefault();
+    var ref = link.getAttribute('href').substring(1);
+    loadNotes().then(function (index) {
+      var note = index[ref];
+      if (!note) { return; }
+      popup.innerHTML = '<p><strong>' + note[0] + '</strong></p><p><em>Base: ' + note[1] + '</em></p>';
+      popup.style.display = 'block';
+    });
+  });
+})();
+"""
+
+def reader_page(title, body, notes_href, nav):
+    return (
+        "<!DOCTYPE html>\n"
+        f'<html><head><meta charset="utf-8"/><title>{title}</title>'
+        '<link rel="stylesheet" href="reader.css"/></head>'
+        f'<body data-notes="{notes_href}">{nav}{body}{nav}'
+        '<div id="popup"></div><script src="reader.js" defer></script></body></html>'
+    )
+
+def output_book_html(job_file, source_folder = "user", output_dir = "reader", lang = None):
+    """
+    Writes a whole woven book as a small static site:
+    index.html, one chapter_NNN.html per source file and notes/chapter_NNN.json.
+    lang: which language of a multi-language job to export (needed if it has several).
+    """
+    job_data = jobfile.load_job(Path(source_folder) / job_file)
+    languages = chunker.job_languages(job_data)
+    if lang is None and languages:
+        if len(languages) > 1:
+            raise ValueError(f"{job_file} is a multi-language job ({', '.join(languages)}); pick one with --lang")
+        lang = languages[0]
+
+    out = Path(source_folder) / output_dir
+    (out / "notes").mkdir(parents = True, exist_ok = True)
+    (out / "reader.css").write_text(READER_CSS, encoding="utf-8")
+    (out / "reader.js").write_text(READER_JS, encoding="utf-8")
+
+    # 1. Group chunks by chapter, keeping the book order
+    chapter_map = chunker.chapter_texts(job_data, lang)
+
+    # 2. One page and one footnote file per chapter
+    contents = []
+    total = len(chapter_map)
+    for n, text in enumerate(chapter_map.values(), start = 1):
+        page_name = f"chapter_{n:03}.html"
+        notes_name = f"notes/chapter_{n:03}.json"
+
+        replacer = TagReplacer(compact = True)
+        body, _ = footnoter(input_text = text, compact = True, replacer = replacer)
+
+        # Title: first line of the chapter, without any woven markup
+        first_line = re.sub(r'\{(.*?)\|.*?\}', r'\1', text.strip().split("\n")[0])
+        title = html.escape(first_line[:60]) or f"Chapter {n}"
+        contents.append(f'<li><a href="{page_name}">{title}</a></li>')
+
+        links = ['<a href="index.html">Contents</a>']
+        if n > 1:
+            links.insert(0, f'<a href="chapter_{n - 1:03}.html">Previous</a>')
+        if n < total:
+            links.append(f'<a href="chapter_{n + 1:03}.html">Next</a>')
+        nav = "<nav>" + " | ".join(links) + "</nav>"
+
+        (out / page_name).write_text(reader_page(title, body, notes_name, nav), encoding="utf-8")
+        with open(out / notes_name, "w", encoding="utf-8") as f:
+            json.dump(replacer.notes, f, ensure_ascii = False, separators = (",", ":"))
+
+    # 3. Table of contents
+    index = reader_page("Contents", "<ol>" + "".join(contents) + "</ol>", "", "")
+    (out / "index.html").write_text(index, encoding="utf-8")
+    print(f"Wrote {total} chapter pages to {out}")
+    return out
+
 def main():
     body, notes = footnoter()
     output_html(body, notes)
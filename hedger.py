@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+# Request hedging: when a call has taken longer than most recent calls (e.g. p95),
+# send the same request again and use whichever answer comes back first.
+# Only a small share of requests may be hedged, so the extra API load stays bounded.
+
+class LatencyTracker:
+    def __init__(self, window = 200):
+        self.samples = deque(maxlen = window)   # Seconds, most recent calls only
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p):
+        with self.lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class HedgedCaller:
+    def __init__(
+        self,
+        percentile = 95,
+        max_hedge_ratio = 0.1,
+        burst = 3,
+        timeout = 300,
+        initial_delay = 60,
+        min_samples = 20,
+        window = 200
+    ):
+        """
+        percentile: hedge once a call is slower than this share of recent calls
+        max_hedge_ratio, burst: the rate budget, at most burst + max_hedge_ratio * requests hedges
+        timeout: give up on a request (and its hedge) after this many seconds
+        initial_delay: hedge delay used until min_samples latencies have been seen
+        """
+        self.percentile = percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.burst = burst
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.latencies = LatencyTracker(window)
+        # Stalled calls can't be interrupted, so leave room for them to finish in the background
+        # (the client's own timeout, see weaver.get_client, ends them)
+        self.pool = ThreadPoolExecutor(max_workers = 32)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "hedges": 0, "hedge_wins": 0, "timeouts": 0}
+
+    def hedge_delay(self):
+        if len(self.latencies.samples) < self.min_samples:
+            return self.initial_delay
+        return self.latencies.percentile(self.percentile)
+
+    def take_hedge(self):
+        # Rate budget: a few hedges up front, then max_hedge_ratio per request
+        with self.lock:
+            if self.stats["hedges"] + 1 > self.burst + self.max_hedge_ratio * self.stats["requests"]:
+                return False
+            self.stats["hedges"] += 1
+            return True
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs), hedging it if it is slow. Returns the first valid result.
+        Raises TimeoutError after self.timeout, or the error of the last failed attempt.
+        """
+        with self.lock:
+            self.stats["requests"] += 1
+        started = time.perf_counter()
+        deadline = started + self.timeout
+
+        primary = self.pool.submit(fn, *args, **kwargs)
+        attempts = {primary: "primary"}
+        done, _ = wait([primary], timeout = min(self.hedge_delay(), self.timeout))
+
+        if not done and self.take_hedge():
+            attempts[self.pool.submit(fn, *args, **kwargs)] = "hedge"
+
+        error = None
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, timeout = max(0, deadline - time.perf_counter()), return_when = FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                # First valid answer wins; the loser is cancelled (or, if already running, ignored)
+                for other in pending:
+                    other.cancel()
+                self.latencies.add(time.perf_counter() - started)
+                if attempts[future] == "hedge":
+                    with self.lock:
+                        self.stats["hedge_wins"] += 1
+                return future.result()
+
+        if error is not None and not pending:
+            raise error
+        with self.lock:
+            self.stats["timeouts"] += 1
+        for future in pending:
+            future.cancel()
+        raise TimeoutError(f"No response after {self.timeout}s")
+
+    def report(self):
+        s = self.stats
+        return (f"{s['requests']} requests, {s['hedges']} hedges issued, "
+                f"{s['hedge_wins']} won by the hedge, {s['timeouts']} timed out")
+
+
+# --- BENCHMARK AGAINST THE MOCK BACKEND ---
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    return pick(50), pick(95), pick(99)
+
+def benchmark(requests = 200, stall_rate = 0.02, stall_seconds = 0.5, seed = 1):
+    """
+    Compares end-to-end latency with and without hedging on a mock backend that stalls
+    stall_rate of its requests.
+    """
+    import mock_backend
+
+    text = "Now was the day departing, and the air imbrown'd with shadows."
+    for hedged in (False, True):
+        client = mock_backend.MockClient(ttft = 0.02, tokens_per_second = 5000, stall_rate = stall_rate,
+                                         stall_seconds = stall_seconds, seed = seed)
+        caller = HedgedCaller(initial_delay = 0.2)
+        timings = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            if hedged:
+                caller.call(client.models.generate_content, model = "mock", contents = ["prompt", text, []])
+            else:
+                client.models.generate_content(model = "mock", contents = ["prompt", text, []])
+            timings.append(time.perf_counter() - started)
+
+        p50, p95, p99 = percentiles(timings)
+        label = "hedged  " if hedged else "unhedged"
+        print(f"{label}: p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, p99 {p99 * 1000:.0f} ms, {client.calls} API calls")
+        if hedged:
+            print(f"          {caller.report()}")
+
+def main():
+    benchmark()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import json
+import struct
+import time
+import zlib
+from pathlib import Path
+
+
+# Job files can be saved as pretty-printed JSON (.json) or in a compact binary format (.djob):
+#
+#   b"DJOB" | version (1 byte) | header size (4 bytes, little-endian) | header | chunks
+#
+# Every chunk is its JSON object, compressed with zlib on its own. The header is the
+# zlib-compressed JSON list of [id, source_file, status, offset, size] per chunk (status is
+# {lang: status} for a multi-language job), so the status of a job can be read without
+# decompressing the chunks. Loading gives back exactly the JSON data.
+
+MAGIC = b"DJOB"
+VERSION = 1
+PREAMBLE = struct.Struct("<4sBI")
+BINARY_SUFFIX = ".djob"
+
+# Jobs are saved after every woven chunk; only the chunks that changed are compressed again
+_compressed = {}   # (chunk JSON bytes, level) -> compressed bytes
+
+
+def is_binary(path):
+    return Path(path).suffix == BINARY_SUFFIX
+
+def chunk_status(item):
+    if "languages" in item:
+        return {lang: slot["status"] for lang, slot in item["languages"].items()}
+    return item.get("status")
+
+def encode(job_data, level = 6):
+    blobs = []
+    index = []
+    offset = 0
+    if len(_compressed) > 4 * len(job_data):
+        _compressed.clear()
+    for item in job_data:
+        raw = json.dumps(item, ensure_ascii = False, separators = (",", ":")).encode("utf-8")
+        blob = _compressed.get((raw, level))
+        if blob is None:
+            blob = _compressed[(raw, level)] = zlib.compress(raw, level)
+        index.append([item.get("id"), item.get("source_file"), chunk_status(item), offset, len(blob)])
+        blobs.append(blob)
+        offset += len(blob)
+    header = zlib.compress(json.dumps(index, ensure_ascii = False, separators = (",", ":")).encode("utf-8"), level)
+    return PREAMBLE.pack(MAGIC, VERSION, len(header)) + header + b"".join(blobs)
+
+def decode_header(data):
+    magic, version, header_size = PREAMBLE.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a .djob job file")
+    if version != VERSION:
+        raise ValueError(f"Unsupported .djob version {version}")
+    start = PREAMBLE.size
+    index = json.loads(zlib.decompress(data[start:start + header_size]))
+    return index, start + header_size
+
+def decode(data):
+    index, base = decode_header(data)
+    return [json.loads(zlib.decompress(data[base + offset:base + offset + size])) for _, _, _, offset, size in index]
+
+def load_job(path):
+    if is_binary(path):
+        with open(path, "rb") as f:
+            return decode(f.read())
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_job(path, job_data):
+    if is_binary(path):
+        with open(path, "wb") as f:
+            f.write(encode(job_data))
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(job_data, f, indent=2)
+
+def read_index(path):
+    """
+    [(id, source_file, status), ...] without decompressing the chunks of a .djob file.
+    """
+    if not is_binary(path):
+        return [(item.get("id"), item.get("source_file"), chunk_status(item)) for item in load_job(path)]
+    with open(path, "rb") as f:
+        preamble = f.read(PREAMBLE.size)
+        header = f.read(PREAMBLE.unpack(preamble)[2])
+    index, _ = decode_header(preamble + header)
+    return [(cid, source_file, status) for cid, source_file, status, _, _ in index]
+
+def convert(source, destination):
+    """
+    Converts a job between .json and .djob (by the file suffixes). Returns the sizes.
+    """
+    job_data = load_job(source)
+    save_job(destination, job_data)
+    if load_job(destination) != job_data:
+        raise ValueError(f"{destination} doesn't round-trip")
+    return Path(source).stat().st_size, Path(destination).stat().st_size
+
+
+# --- BENCHMARK ---
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def benchmark(job_file = "user/chunked_Dante - The Divine Comedy.json", repeat = 5):
+    """
+    Best-of-repeat load and save times, and file sizes, of a job as .json and .djob.
+    """
+    import tempfile
+
+    job_data = load_job(job_file)
+    with tempfile.TemporaryDirectory() as folder:
+        for suffix in (".json", BINARY_SUFFIX):
+            path = Path(folder) / f"job{suffix}"
+            _compressed.clear()
+            first_save = timed(lambda: save_job(path, job_data), 1)
+            # A checkpoint: the same job again with one chunk changed
+            job_data[0]["status"] = "completed" if job_data[0]["status"] != "completed" else "pending"
+            save = timed(lambda: save_job(path, job_data), repeat)
+            load = timed(lambda: load_job(path), repeat)
+            assert load_job(path) == job_data
+            status = timed(lambda: read_index(path), repeat)
+            print(f"{suffix:6} {path.stat().st_size / 1024:8.1f} KB   first save {first_save * 1000:6.1f} ms   "
+                  f"checkpoint save {save * 1000:6.1f} ms   load {load * 1000:6.1f} ms   status {status * 1000:6.1f} ms")
+
+def main():
+    benchmark()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,14 @@
-import re
-import ebooklib
-import json
-from ebooklib import epub
-from bs4 import BeautifulSoup
 from pathlib import Path
-from google import genai
-from google.genai import types
-from pydantic import BaseModel
-import sys
-import html
+import argparse
 import chunker
-import weaver
+import jobfile
 import footnoter
 import time
+import copy
+import posixpath
+
+# NOTE: weaver, ebooklib and bs4 are imported inside the functions that need them,
+# so importing this module (or running `status`) stays fast and has no side effects.
 
 # --- 1. CONFIGURATION ---
 MIN_CHAPTER_LENGTH = 500  # If a file has fewer chars than this, it's likely front matter
@@ -45,43 +41,101 @@ def should_skip_file(soup):
     # If it passes all tests, it's a real chapter!
     return False
 
-def process_job(job_file="chunked_Dante - The Divine Comedy.json", folder = "user", max_calls = 5):
+def process_job(
+    job_file="chunked_Dante - The Divine Comedy.json",
+    folder = "user",
+    max_calls = 5,
+    target_lang = "Italian",
+    client = None,
+    stream = False,
+    pause = 8,
+    hedger = None,
+    router = None,
+    cache = None,
+    position = None,
+    window = 10
+):
+    """
+    Weaves pending chunks in file order, saving after each one.
+    position: the reader's chunk id or chapter file. The window chunks from there are all
+    woven first (they don't count towards max_calls), then up to max_calls of the rest,
+    carrying on after the window and wrapping round to the start of the book.
+    stream: stream the responses and checkpoint whole paragraphs into the chunk's
+    'partial_text' as they arrive, so an interrupted chunk resumes where it stopped.
+    hedger: a hedger.HedgedCaller, to duplicate calls slower than its percentile.
+    router: a router.ModelRouter, to try a cheaper model first on easy chunks.
+    cache: a prompt_cache.PromptCache, to send the prompt as a cached context.
+    """
+    import scheduler
+    import weaver
+
     # 1. Load the current state
     path = Path(folder) / job_file
-    with open(path, "r", encoding="utf-8") as f:
-        job_data = json.load(f)
+    job_data = jobfile.load_job(path)
+
+    # Multi-language job: work on this language's slots
+    multi = bool(chunker.job_languages(job_data))
+    if multi:
+        chunker.add_languages(job_data, [target_lang])
+    chunker.ensure_vocab_file(folder, target_lang if multi else None)
     
     n = 0
-    # 2. Find work to do
-    for item in job_data:
-        if item["status"] == "pending" and n < max_calls:
+    # 2. Find work to do: the reader's read-ahead window, then the backfill
+    ahead, backfill = scheduler.reading_order(job_data, position, window)
+    for i, item in enumerate(ahead + backfill):
+        if ahead and i == len(ahead):
+            print("Read-ahead window ready.")
+        reading_ahead = i < len(ahead)
+        slot = chunker.job_slot(item, target_lang)
+        if slot["status"] == "pending" and (reading_ahead or n < max_calls):
             print(f"Processing Chunk {item['id']} (from {item['source_file']})...")
+
+            # Partial checkpoint: save whenever another whole paragraph has arrived
+            def checkpoint(text_so_far, slot = slot):
+                done = weaver.completed_paragraphs(text_so_far)
+                if len(done) > len(slot.get("partial_text", "")):
+                    slot["partial_text"] = done
+                    jobfile.save_job(path, job_data)
             
             try:
                 # --- CALL YOUR API HERE ---
-                result_text = weaver.weave(target_lang = "Italian", en_text = item['original_text'])
+                result_text = weaver.weave(
+                    source_folder = folder,
+                    target_lang = target_lang,
+                    known_words_filename = chunker.vocab_filename(target_lang if multi else None),
+                    en_text = item['original_text'],
+                    client = client,
+                    stream = stream,
+                    partial_text = slot.get("partial_text", ""),
+                    on_progress = checkpoint if stream else None,
+                    hedger = hedger,
+                    router = router,
+                    cache = cache,
+                )
                 # Simulated result for testing:
                 # result_text = f"Simulated translation of: {item['original_text'][:20]}..."
                 
                 # 3. Update the record in memory
-                item["translated_text"] = result_text
-                item["status"] = "completed"
+                slot["translated_text"] = result_text
+                slot["status"] = "completed"
+                slot.pop("partial_text", None)
                 
                 # 4. SAVE IMMEDIATELY (Checkpointing)
                 # This ensures if you crash now, this chunk is saved.
-                with open(path, "w", encoding="utf-8") as f:
-                    json.dump(job_data, f, indent=2)
+                jobfile.save_job(path, job_data)
                     
                 print(f"Chunk {item['id']} saved.")
                 
-                n += 1
+                if not reading_ahead:
+                    n += 1
                 # Be nice to the API
-                time.sleep(8) 
+                time.sleep(pause) 
 
             except Exception as e:
                 print(f"Error on Chunk {item['id']}: {e}")
                 break # Stop processing so you can fix the error
 
+    scheduler.finish_run(hedger, router, cache)
     print("Job finished or stopped.")
 
 # To deal with a technical saving issue
@@ -134,41 +188,129 @@ def sanitize_book_ids(book):
     fix_toc_ids(book.toc, [1])
 
 
+# Shared stylesheet for compact output (one manifest item instead of a <style> per chapter)
+DIGLOT_CSS = """a.ru { color: #2980b9; text-decoration: none; border-bottom: 1px dotted #2980b9; }
+aside.footnote-hidden { display: none; visibility: hidden; }
+section.footnotes { border-top: 1px solid #eee; margin-top: 2em; display: none; }
+"""
+DIGLOT_CSS_NAME = "Styles/diglot.css"
+
+def render_chapter(original_soup, full_text, compact = False, css_href = None):
+    """
+    Builds the XHTML page for one chapter from the (woven) chapter text.
+    compact: deduplicated footnotes, a <link> to the shared stylesheet instead of
+    an inline <style>, and minified markup.
+    """
+    # 1. Format text and compile footnotes
+    body_content, footnotes = footnoter.footnoter(input_text = full_text, compact = compact)
+
+    # --- START OF NEW STYLE TRANSPLANT LOGIC ---
+    
+    # 2. HEADER RESCUE (Critical for Gutenberg TOCs)
+    original_headers = ""
+    if original_soup.body:
+        headers = original_soup.body.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+        for h in headers:
+            original_headers += str(h) + "\n"
+
+    # 3. STYLE TRANSPLANT
+    # (Work on a copy so the same soup can be rendered more than once)
+    new_head = copy.copy(original_soup.head) if original_soup.head else None
+    if not new_head: new_head = original_soup.new_tag("head")
+
+    if compact:
+        # Reference the shared stylesheet
+        new_head.append(original_soup.new_tag("link", rel="stylesheet", type="text/css", href=css_href))
+    else:
+        # Inject CSS
+        style_tag = original_soup.new_tag("style")
+        style_tag.string = DIGLOT_CSS
+        new_head.append(style_tag)
+    
+    if not new_head.find("meta", {"charset": "utf-8"}):
+        new_head.insert(0, original_soup.new_tag("meta", charset="utf-8"))
+
+    # 4. Build Page
+    body_attrs = original_soup.body.attrs if original_soup.body else {}
+    attr_str = "".join([f' {k}="{v}"' if isinstance(v, str) else f' {k}="{" ".join(v)}"' for k,v in body_attrs.items()])
+
+    final_page = f"""<?xml version='1.0' encoding='utf-8'?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="en">
+{new_head}
+<body{attr_str}>
+    {original_headers}
+    
+    {body_content}
+    
+    <section class="footnotes">
+        {footnotes}
+    </section>
+</body>
+</html>"""
+
+    if compact:
+        # Keep the XML declaration on its own line, minify the rest
+        declaration, rest = final_page.split("\n", 1)
+        final_page = declaration + "\n" + footnoter.minify_markup(rest)
+
+    return final_page
+
+
 def compiler(
     original,
     json_file,
     output,
     source_folder = "user",
+    compact = False,
+    languages = None,
 ):
+    """
+    Injects the woven chunks back into the original EPUB.
+    compact: one shared CSS item, one footnote per (lemma, word) per chapter and
+    minified markup. The chapter size against the normal output is reported.
+    languages: for a multi-language job, writes one EPUB per language
+    (output "Dante_weave.epub" -> "Dante_weave_Italian.epub", ...) from a single
+    pass over the source book. Defaults to all of the job's languages.
+    """
+    from ebooklib import epub
+    from bs4 import BeautifulSoup
+
     original_epub = Path(source_folder) / original
     job_file = Path(source_folder) / json_file
     output_epub = Path(source_folder) / output
     
     # A. Load Data
     book = epub.read_epub(original_epub)
-    with open(job_file, 'r', encoding='utf-8') as f:
-        job_data = json.load(f)
+    job_data = jobfile.load_job(job_file)
     
-    # B. Group chunks by filename
-    # {'chap01.xhtml': "Full text...", 'chap02.xhtml': "Full text..."}
-    chapter_map = {}
-    for item in job_data:
-        fname = item['source_file']
-        text = item.get('translated_text') or item['original_text']
-        
-        if fname not in chapter_map:
-            chapter_map[fname] = []
-        chapter_map[fname].append(text)
+    # B. Group chunks by filename (None = the single-language job)
+    languages = list(languages or chunker.job_languages(job_data) or [None])
+    chapter_maps = {lang: chunker.chapter_texts(job_data, lang) for lang in languages}
+    chapter_names = set(chapter_maps[languages[0]])
     
-    # C. Insert new text into the existing book
-    print(f"Injecting translations into {len(chapter_map)} chapters...")
+    # Compact mode: register the stylesheet once for the whole book
+    if compact:
+        book.add_item(epub.EpubItem(
+            uid = "diglot_css",
+            file_name = DIGLOT_CSS_NAME,
+            media_type = "text/css",
+            content = DIGLOT_CSS.encode('utf-8'),
+        ))
+    normal_size = 0
+    compact_size = 0
     
-    for item in book.get_items():
+    # C. Build the new pages: each chapter is parsed once and rendered for every language
+    print(f"Injecting translations into {len(chapter_names)} chapters...")
+    pages = {lang: {} for lang in languages}  # lang -> {index in book.items: page}
+    
+    for index, item in enumerate(book.get_items()):
         # Only process if we have translation data AND it's an XHTML file
-        if item.get_name() in chapter_map and item.media_type == 'application/xhtml+xml':
+        if item.get_name() in chapter_names and item.media_type == 'application/xhtml+xml':
             
             # 1. Parse FIRST to check content
-            original_soup = BeautifulSoup(item.get_content(), 'html.parser')
+            # (compact mode keeps the original <head>, so it reads the raw file)
+            raw_content = item.content if compact else item.get_content()
+            original_soup = BeautifulSoup(raw_content, 'html.parser')
             
             # 2. RUN THE FILTER
             if should_skip_file(original_soup):
@@ -177,91 +319,341 @@ def compiler(
 
             print(f"  - Processing Story: {item.get_name()}")
             
-            # 1. Join chunks
-            full_text = "\n\n".join(chapter_map[item.get_name()])
-            
-            # 2. Format text and compile footnotes
-            body_content, footnotes = footnoter.footnoter(input_text = full_text)
-            
-            # 3. Add newline for footnotes (formatting that no one will see)
-            notes_content = "\n".join(footnotes)
-            
-            
-            
-            
-            
-            
-            # --- START OF NEW STYLE TRANSPLANT LOGIC ---
-            
-            # 4. HEADER RESCUE (Critical for Gutenberg TOCs)
-            original_headers = ""
-            if original_soup.body:
-                headers = original_soup.body.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-                for h in headers:
-                    original_headers += str(h) + "\n"
-
-            # 5. STYLE TRANSPLANT
-            new_head = original_soup.head
-            if not new_head: new_head = original_soup.new_tag("head")
-
-            # Inject CSS
-            style_tag = original_soup.new_tag("style")
-            style_tag.string = """
-                a.ru { color: #2980b9; text-decoration: none; border-bottom: 1px dotted #2980b9; }
-                aside.footnote-hidden { display: none; visibility: hidden; }
-                section.footnotes { border-top: 1px solid #eee; margin-top: 2em; display: none; }
-            """
-            new_head.append(style_tag)
-            
-            if not new_head.find("meta", {"charset": "utf-8"}):
-                new_head.insert(0, original_soup.new_tag("meta", charset="utf-8"))
-
-            # 6. Build Page
-            body_attrs = original_soup.body.attrs if original_soup.body else {}
-            attr_str = "".join([f' {k}="{v}"' if isinstance(v, str) else f' {k}="{" ".join(v)}"' for k,v in body_attrs.items()])
-
-            final_page = f"""<?xml version='1.0' encoding='utf-8'?>
-<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="en">
-{new_head}
-<body{attr_str}>
-    {original_headers}
-    
-    {body_content}
-    
-    <section class="footnotes">
-        {footnotes}
-    </section>
-</body>
-</html>"""
-
-            item.set_content(final_page.encode('utf-8'))
+            for lang in languages:
+                # 3. Join chunks (and paragraphs split over chunks)
+                full_text = chapter_maps[lang][item.get_name()]
+                
+                if not compact:
+                    pages[lang][index] = render_chapter(original_soup, full_text).encode('utf-8')
+                    continue
+
+                # 4. Compact page, measured against the normal one
+                css_href = posixpath.relpath(DIGLOT_CSS_NAME, posixpath.dirname(item.get_name()) or ".")
+                final_page = render_chapter(original_soup, full_text, compact = True, css_href = css_href)
+                normal_size += len(render_chapter(original_soup, full_text).encode('utf-8'))
+                compact_size += len(final_page.encode('utf-8'))
+
+                # ebooklib rebuilds (and pretty-prints) EpubHtml pages on save, dropping the <head>.
+                # Store the page as a plain item so the minified markup is written as-is.
+                page = epub.EpubItem(
+                    uid = item.id,
+                    file_name = item.file_name,
+                    media_type = item.media_type,
+                    content = final_page.encode('utf-8'),
+                )
+                page.properties = item.properties
+                pages[lang][index] = page
             
             # --- END OF NEW LOGIC ---
     
+    if compact and normal_size:
+        saved = 100 * (1 - compact_size / normal_size)
+        print(f"Chapter markup: {normal_size / 1024:.1f} KB -> {compact_size / 1024:.1f} KB ({saved:.1f}% smaller)")
+    
     # D. Ensure no saving errors
     print("Sanitizing IDs...")
     sanitize_book_ids(book)
     
-    # E. Save the new Book
-    epub.write_epub(output_epub, book, {})
-    print(f"Success! Book saved to: {output_epub}")
-
-
-
-
-
-
-
-# --- RUN IT ---
-# process_job(max_calls = 5)
-
-# Adjust filenames as needed
-
-compiler("Dante - The Divine Comedy.epub", "chunked_Dante - The Divine Comedy.json", "Dante_weave.epub")
-
-
-
-
-
-
-
+    # E. Save one book per language
+    outputs = []
+    for lang in languages:
+        for index, page in pages[lang].items():
+            if compact:
+                book.items[index] = page
+            else:
+                book.items[index].set_content(page)
+
+        lang_epub = output_epub if lang is None else output_epub.with_name(f"{output_epub.stem}_{lang}{output_epub.suffix}")
+        epub.write_epub(lang_epub, book, {})
+        print(f"Success! Book saved to: {lang_epub}")
+        outputs.append(lang_epub)
+    return outputs
+
+
+def job_status(job_file="chunked_Dante - The Divine Comedy.json", folder = "user"):
+    """
+    Counts the chunks of a job by status. Only reads the job file (for a .djob file,
+    only its header).
+    Returns: {None: {'pending': 120, 'completed': 6, ...}} for a single-language job,
+    {'Italian': {...}, 'Russian': {...}} for a multi-language job.
+    """
+    counts = {}
+    for _, _, status in jobfile.read_index(Path(folder) / job_file):
+        # {lang: status} in a multi-language job
+        for lang, lang_status in (status.items() if isinstance(status, dict) else [(None, status)]):
+            lang_counts = counts.setdefault(lang, {})
+            lang_counts[lang_status] = lang_counts.get(lang_status, 0) + 1
+    return counts
+
+
+# --- COMMAND LINE ---
+
+def cmd_chunk(args):
+    book_name = args.book or Path(args.epub).stem
+    chunker.chunker(source_folder = args.folder, book_name = book_name, file_name = args.epub, max_chars = args.max_chars, languages = args.lang)
+
+def cmd_ingest(args):
+    chunker.ingest_library(source_folder = args.folder, max_chars = args.max_chars, workers = args.workers)
+
+def cmd_rechunk(args):
+    book_name = args.book or Path(args.epub).stem
+    chunker.rechunk(source_folder = args.folder, book_name = book_name, file_name = args.epub, max_chars = args.max_chars)
+
+def get_client(args):
+    # --mock swaps Gemini for the local mock backend
+    if args.mock:
+        import mock_backend
+        return mock_backend.MockClient(timeout = args.timeout)
+    import weaver
+    return weaver.get_client(timeout = args.timeout)
+
+def get_hedger(args):
+    if args.hedge is None:
+        return None
+    import hedger
+    return hedger.HedgedCaller(percentile = args.hedge, timeout = args.timeout)
+
+def get_router(args):
+    if not args.route:
+        return None
+    import router
+    return router.ModelRouter(stats_file = Path(args.folder) / "routing_stats.json")
+
+def get_cache(args):
+    if not args.cache:
+        return None
+    import prompt_cache
+    return prompt_cache.PromptCache(ttl = args.cache_ttl, freeze_vocabulary = args.freeze_vocab)
+
+def cmd_weave(args):
+    languages = args.lang or ["Italian"]
+    if len(languages) > 1:
+        import scheduler
+        scheduler.process_languages(
+            job_file = args.job,
+            languages = languages,
+            folder = args.folder,
+            max_calls = args.max_calls,
+            workers = args.workers,
+            client = get_client(args),
+            pause = args.pause,
+            hedger = get_hedger(args),
+            router = get_router(args),
+            cache = get_cache(args),
+            position = args.position,
+            window = args.window,
+        )
+        return
+    process_job(
+        job_file = args.job,
+        folder = args.folder,
+        max_calls = args.max_calls,
+        target_lang = languages[0],
+        client = get_client(args),
+        stream = args.stream,
+        pause = args.pause,
+        hedger = get_hedger(args),
+        router = get_router(args),
+        cache = get_cache(args),
+        position = args.position,
+        window = args.window,
+    )
+
+def coordinator_db(args):
+    import coordinator
+    return coordinator.connect(args.db or Path(args.folder) / coordinator.DB_FILE)
+
+def print_queue(db):
+    import coordinator
+    for (job, lang), counts in sorted(coordinator.queue_status(db).items()):
+        print(f"{job} [{lang}]: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+
+def cmd_queue(args):
+    import coordinator
+    db = coordinator_db(args)
+    coordinator.queue_job(db, args.job, folder = args.folder, languages = args.lang or ["Italian"],
+                          position = args.position, window = args.window)
+    print_queue(db)
+
+def cmd_work(args):
+    import coordinator
+    coordinator.run_worker(
+        args.db or Path(args.folder) / coordinator.DB_FILE,
+        folder = args.folder,
+        worker = args.worker,
+        max_calls = args.max_calls,
+        lease_seconds = args.lease,
+        in_flight = args.in_flight,
+        client = get_client(args),
+        pause = args.pause,
+        hedger = get_hedger(args),
+        router = get_router(args),
+        cache = get_cache(args),
+    )
+
+def cmd_collect(args):
+    import coordinator
+    db = coordinator_db(args)
+    written = coordinator.collect(db, args.job, folder = args.folder)
+    print(f"{written} newly completed chunks written to {args.job}")
+    print_queue(db)
+
+def cmd_compile(args):
+    compiler(args.epub, args.job, args.output, source_folder = args.folder, compact = args.compact, languages = args.lang)
+
+def cmd_plan(args):
+    import planner
+    plan = planner.plan_job(
+        job_file = args.job,
+        folder = args.folder,
+        target_lang = args.lang,
+        concurrency = args.concurrency,
+        rpm = args.rpm,
+        pause = args.pause,
+        ttft = args.ttft,
+        tokens_per_second = args.tokens_per_second,
+    )
+    if args.per_chunk:
+        for c in plan["chunks"]:
+            print(f"  Chunk {c['id']}: {c['input_tokens']} in / {c['output_tokens']} out, {c['vocabulary']} known words")
+    minutes, seconds = divmod(round(plan["seconds"]), 60)
+    print(f"{len(plan['chunks'])} pending chunks")
+    print(f"  Input tokens:  ~{plan['input_tokens']:,}")
+    print(f"  Output tokens: ~{plan['output_tokens']:,}")
+    print(f"  Known words at the end: ~{plan['final_vocabulary']}")
+    print(f"  Wall-clock time: ~{minutes // 60}h {minutes % 60}m {seconds}s")
+
+def cmd_html(args):
+    footnoter.output_book_html(args.job, source_folder = args.folder, output_dir = args.output, lang = args.lang)
+
+def cmd_status(args):
+    for lang, counts in job_status(job_file = args.job, folder = args.folder).items():
+        # Verbatim chunks (boilerplate) are copied through, not woven
+        total = sum(counts.values()) - counts.get("verbatim", 0)
+        done = counts.get("completed", 0)
+        label = f"{args.job} [{lang}]" if lang else args.job
+        print(f"{label}: {done}/{total} chunks completed ({100 * done / max(total, 1):.1f}%)")
+        for status, n in sorted(counts.items()):
+            print(f"  {status}: {n}")
+
+def cmd_convert(args):
+    source = Path(args.folder) / args.source
+    destination = Path(args.folder) / args.destination
+    before, after = jobfile.convert(source, destination)
+    print(f"{source.name} ({before / 1024:.1f} KB) -> {destination.name} ({after / 1024:.1f} KB)")
+
+
+def add_reading_options(p):
+    p.add_argument("--position", help = "Where you are reading: a chunk id or chapter file; weave from there first")
+    p.add_argument("--window", type = int, default = 10, help = "Chunks to weave ahead of --position before anything else (default: 10)")
+
+def add_call_options(p):
+    # How the LLM is called, shared by 'weave' and 'work'
+    p.add_argument("--mock", action = "store_true", help = "Use the local mock backend instead of Gemini")
+    p.add_argument("--hedge", type = float, metavar = "PERCENTILE", help = "Re-send calls slower than this latency percentile, e.g. 95")
+    p.add_argument("--timeout", type = float, default = 300, help = "Give up on a call after this many seconds (default: 300)")
+    p.add_argument("--route", action = "store_true", help = "Try a cheaper model on easy chunks, escalating if its output fails the checks")
+    p.add_argument("--cache", action = "store_true", help = "Send the weaving instructions as a cached context")
+    p.add_argument("--cache-ttl", type = int, default = 3600, help = "Lifetime of the cached context in seconds (default: 3600)")
+    p.add_argument("--freeze-vocab", action = "store_true", help = "Always cache the known words too (by default only when the prompt alone is too small to cache)")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog = "diglot-weave", description = "Create diglot weaves of EPUB books.")
+    parser.add_argument("--folder", default = "user", help = "Folder holding the books and job files (default: user)")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    p = commands.add_parser("chunk", help = "Split an EPUB into a chunked_<book>.json job file")
+    p.add_argument("epub", help = "EPUB file name inside the folder")
+    p.add_argument("--book", help = "Book name used for the job file (default: EPUB file name)")
+    p.add_argument("--max-chars", type = int, default = 4000)
+    p.add_argument("--lang", action = "append", help = "Target language; repeat for a multi-language job")
+    p.set_defaults(func = cmd_chunk)
+
+    p = commands.add_parser("ingest", help = "Chunk every EPUB in the folder (parallel, cached extraction)")
+    p.add_argument("--max-chars", type = int, default = 4000)
+    p.add_argument("--workers", type = int, help = "Extraction processes (default: one per core)")
+    p.set_defaults(func = cmd_ingest)
+
+    p = commands.add_parser("rechunk", help = "Re-chunk a book and keep the work already done on its job")
+    p.add_argument("epub", help = "EPUB file name inside the folder")
+    p.add_argument("--book", help = "Book name of the existing job file (default: EPUB file name)")
+    p.add_argument("--max-chars", type = int, default = 4000)
+    p.set_defaults(func = cmd_rechunk)
+
+    p = commands.add_parser("weave", help = "Send pending chunks of a job to the LLM")
+    p.add_argument("job", help = "Job file name inside the folder")
+    p.add_argument("--lang", action = "append", help = "Target language (default: Italian); repeat to weave several at once")
+    p.add_argument("--max-calls", type = int, default = 5, help = "Chunks to weave per language (default: 5)")
+    p.add_argument("--workers", type = int, help = "Shared worker pool size for several languages (default: one per language)")
+    p.add_argument("--pause", type = float, default = 8, help = "Seconds to wait between calls (default: 8)")
+    p.add_argument("--stream", action = "store_true", help = "Stream responses and checkpoint partial output")
+    add_reading_options(p)
+    add_call_options(p)
+    p.set_defaults(func = cmd_weave)
+
+    p = commands.add_parser("queue", help = "Add a job's chunks to the coordinator queue for 'work'")
+    p.add_argument("job", help = "Job file name inside the folder")
+    p.add_argument("--lang", action = "append", help = "Target language (default: Italian); repeat for several")
+    p.add_argument("--db", help = "Coordinator database (default: <folder>/coordinator.db)")
+    add_reading_options(p)
+    p.set_defaults(func = cmd_queue)
+
+    p = commands.add_parser("work", help = "Lease and weave queued chunks; run as many workers as you like")
+    p.add_argument("--db", help = "Coordinator database (default: <folder>/coordinator.db)")
+    p.add_argument("--worker", help = "Worker name (default: host name and a random suffix)")
+    p.add_argument("--max-calls", type = int, help = "Stop after this many chunks (default: until the queue is empty)")
+    p.add_argument("--lease", type = float, default = 600, help = "Lease time in seconds, renewed while the call runs (default: 600)")
+    p.add_argument("--in-flight", type = int, default = 1, help = "Chunks of one language woven at the same time (default: 1)")
+    p.add_argument("--pause", type = float, default = 8, help = "Seconds to wait between calls (default: 8)")
+    add_call_options(p)
+    p.set_defaults(func = cmd_work)
+
+    p = commands.add_parser("collect", help = "Write the coordinator's results back into a job file")
+    p.add_argument("job", help = "Job file name inside the folder")
+    p.add_argument("--db", help = "Coordinator database (default: <folder>/coordinator.db)")
+    p.set_defaults(func = cmd_collect)
+
+    p = commands.add_parser("plan", help = "Dry run: estimate tokens and time for the pending chunks")
+    p.add_argument("job", help = "Job file name inside the folder")
+    p.add_argument("--lang", default = "Italian", help = "Target language (default: Italian)")
+    p.add_argument("--concurrency", type = int, default = 1, help = "Parallel workers (default: 1)")
+    p.add_argument("--rpm", type = int, help = "Requests per minute limit")
+    p.add_argument("--pause", type = float, default = 8, help = "Seconds to wait between calls (default: 8)")
+    p.add_argument("--ttft", type = float, default = 2.0, help = "Assumed seconds to first token (default: 2)")
+    p.add_argument("--tokens-per-second", type = float, default = 150, help = "Assumed output speed (default: 150)")
+    p.add_argument("--per-chunk", action = "store_true", help = "Also print the estimate for every chunk")
+    p.set_defaults(func = cmd_plan)
+
+    p = commands.add_parser("compile", help = "Build the woven EPUB from a job file")
+    p.add_argument("epub", help = "Original EPUB file name inside the folder")
+    p.add_argument("job", help = "Job file name inside the folder")
+    p.add_argument("output", help = "Output EPUB file name")
+    p.add_argument("--compact", action = "store_true", help = "Shared CSS, deduplicated footnotes, minified markup")
+    p.add_argument("--lang", action = "append", help = "Language of a multi-language job; repeat for one EPUB per language")
+    p.set_defaults(func = cmd_compile)
+
+    p = commands.add_parser("html", help = "Export a job as paginated HTML reader pages")
+    p.add_argument("job", help = "Job file name inside the folder")
+    p.add_argument("--output", default = "reader", help = "Output folder inside the folder (default: reader)")
+    p.add_argument("--lang", help = "Language to export from a multi-language job")
+    p.set_defaults(func = cmd_html)
+
+    p = commands.add_parser("status", help = "Show the progress of a job")
+    p.add_argument("job", help = "Job file name inside the folder")
+    p.set_defaults(func = cmd_status)
+
+    p = commands.add_parser("convert", help = "Convert a job file between .json and the compact binary .djob format")
+    p.add_argument("source", help = "Job file name inside the folder")
+    p.add_argument("destination", help = "New job file name; the suffix (.json or .djob) picks the format")
+    p.set_defaults(func = cmd_convert)
+
+    return parser
+
+
+def main(argv = None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
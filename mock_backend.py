@@ -0,0 +1,183 @@
+import json
+import random
+import time
+from types import SimpleNamespace
+
+
+# A stand-in for google.genai.Client, for testing the pipeline without an API key.
+# It "weaves" by echoing the English text back (with a couple of known words marked up),
+# and simulates latency: a time to first token, then a steady token rate, plus the
+# occasional stalled request.
+
+def count_tokens(text):
+    # Rough rule of thumb: ~4 characters per token
+    return max(1, len(text) // 4)
+
+def tokens_in(contents):
+    return sum(count_tokens(json.dumps(c, ensure_ascii = False)) for c in contents)
+
+def ttl_seconds(config):
+    # "3600s" -> 3600.0
+    return float(str(config.get("ttl", "3600s")).rstrip("s"))
+
+
+class MockModels:
+    def __init__(self, client):
+        self.client = client
+
+    def _reply(self, model, contents):
+        """
+        Builds the JSON reply for a request. contents ends with [text, known_words]; a cached
+        context may hold more known words before the text.
+        """
+        text = contents[-2]
+        words = [word for c in contents if isinstance(c, list) for word in c]
+        modified = text
+        for word in list(words)[:3]:
+            # Mark up the first whole-word English match of a known lemma, if there is one
+            modified = modified.replace(f" {word} ", f" {{{word}|{word}|{word}}} ", 1)
+        if self.client.random.random() < self.client.bad_output.get(model, 0.0):
+            # A sloppy answer: the last paragraph is dropped
+            modified = modified.rsplit("\n\n", 1)[0] if "\n\n" in modified else ""
+        return json.dumps({"modified_text": modified, "new_words": []}, ensure_ascii = False)
+
+    def _usage(self, contents, cached, reply):
+        prompt_tokens = tokens_in(contents)
+        return SimpleNamespace(
+            prompt_token_count = prompt_tokens + tokens_in(cached),
+            cached_content_token_count = tokens_in(cached),
+            candidates_token_count = count_tokens(reply),
+            total_token_count = prompt_tokens + tokens_in(cached) + count_tokens(reply),
+        )
+
+    def generate_content(self, model, contents, config = None):
+        self.client.calls += 1
+        cached = self.client.caches.contents_for(model, config)
+        reply = self._reply(model, cached + contents)
+        seconds = self.client.latency(count_tokens(reply)) + self.client.prefill(tokens_in(contents))
+        self.client.wait(seconds * self.client.speed.get(model, 1.0))
+
+        parsed = None
+        if config and config.get("response_schema") is not None:
+            parsed = config["response_schema"].model_validate_json(reply)
+        return SimpleNamespace(text = reply, parsed = parsed, usage_metadata = self._usage(contents, cached, reply))
+
+    def generate_content_stream(self, model, contents, config = None):
+        self.client.calls += 1
+        cached = self.client.caches.contents_for(model, config)
+        reply = self._reply(model, cached + contents)
+        piece = self.client.piece_chars
+
+        self.client.wait(self.client.ttft + self.client.stall() + self.client.prefill(tokens_in(contents)))
+        for start in range(0, len(reply), piece):
+            if self.client.fail_after is not None and start >= self.client.fail_after:
+                raise TimeoutError("Mock stream cut off")
+            # Like the API, the usage comes with the last piece
+            last = start + piece >= len(reply)
+            usage = self._usage(contents, cached, reply) if last else None
+            yield SimpleNamespace(text = reply[start:start + piece], usage_metadata = usage)
+            time.sleep(count_tokens(reply[start:start + piece]) / self.client.tokens_per_second)
+
+
+class MockCaches:
+    """
+    Context caching: client.caches.create/update/delete and the cached_content request option.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.entries = {}   # name -> {'model', 'contents', 'expires'}
+        self.created = 0
+
+    def create(self, model, config):
+        contents = list(config["contents"])
+        if tokens_in(contents) < self.client.cache_min_tokens:
+            raise ValueError(f"Cached content is too small: {tokens_in(contents)} tokens, minimum {self.client.cache_min_tokens}")
+        self.created += 1
+        name = f"cachedContents/mock-{self.created}"
+        self.entries[name] = {"model": model, "contents": contents, "expires": time.time() + ttl_seconds(config)}
+        return SimpleNamespace(name = name, model = model, usage_metadata = SimpleNamespace(total_token_count = tokens_in(contents)))
+
+    def get(self, name):
+        entry = self.entries.get(name)
+        if entry is None or entry["expires"] < time.time():
+            raise KeyError(f"Cached content {name} not found or expired")
+        return entry
+
+    def update(self, name, config):
+        self.get(name)["expires"] = time.time() + ttl_seconds(config)
+
+    def delete(self, name):
+        self.get(name)
+        del self.entries[name]
+
+    def contents_for(self, model, config):
+        # The cached contents a request refers to, put in front of its own contents
+        if not config or not config.get("cached_content"):
+            return []
+        entry = self.get(config["cached_content"])
+        if entry["model"] != model:
+            raise ValueError(f"{config['cached_content']} was created for {entry['model']}, not {model}")
+        return entry["contents"]
+
+
+class MockClient:
+    def __init__(
+        self,
+        ttft = 0.3,
+        tokens_per_second = 400,
+        piece_chars = 64,
+        fail_after = None,
+        stall_rate = 0.0,
+        stall_seconds = 10.0,
+        bad_output = None,
+        speed = None,
+        prefill_tokens_per_second = None,
+        cache_min_tokens = 1024,
+        timeout = None,
+        seed = None
+    ):
+        """
+        ttft: seconds before the first token
+        tokens_per_second: generation speed after the first token
+        piece_chars: size of each streamed piece
+        fail_after: raise mid-stream after this many characters (to test resuming)
+        stall_rate: share of requests that hang for an extra stall_seconds (tail latency)
+        bad_output: {model: share of replies that fail the local checks}
+        speed: {model: latency multiplier}, e.g. {"gemini-flash-lite-latest": 0.4}
+        prefill_tokens_per_second: input processing speed; cached input is free (None: input costs no time)
+        cache_min_tokens: smallest context client.caches.create accepts
+        timeout: like the real client's HTTP timeout, a request slower than this many seconds fails
+        """
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.piece_chars = piece_chars
+        self.fail_after = fail_after
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.bad_output = bad_output or {}
+        self.speed = speed or {}
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.cache_min_tokens = cache_min_tokens
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.models = MockModels(self)
+        self.caches = MockCaches(self)
+
+    def stall(self):
+        return self.stall_seconds if self.random.random() < self.stall_rate else 0.0
+
+    def prefill(self, input_tokens):
+        if not self.prefill_tokens_per_second:
+            return 0.0
+        return input_tokens / self.prefill_tokens_per_second
+
+    def wait(self, seconds):
+        if self.timeout is not None and seconds > self.timeout:
+            time.sleep(self.timeout)
+            raise TimeoutError(f"Mock request timed out after {self.timeout}s")
+        time.sleep(seconds)
+
+    def latency(self, output_tokens):
+        # Time for a complete (non-streamed) response
+        return self.ttft + self.stall() + output_tokens / self.tokens_per_second
@@ -0,0 +1,138 @@
+import heapq
+import json
+from collections import deque
+from pathlib import Path
+
+import chunker
+import jobfile
+import weaver
+
+
+# Dry run of a job: estimates tokens and wall-clock time without calling the API.
+# Token counts use the ~4 characters per token rule of thumb, so treat them as estimates.
+
+CHARS_PER_TOKEN = 4
+NEW_WORD_RATE = 0.01      # The prompt asks for new words at < 1% of all words
+MARKUP_RATIO = 0.15       # Extra output chars from {Word|Lemma|Original} tags, if the job has no woven chunks yet
+
+
+def estimate_tokens(text):
+    return max(1, round(len(text) / CHARS_PER_TOKEN))
+
+def markup_ratio(job_data, lang = None):
+    """
+    How much longer woven text is than the original, measured on completed chunks.
+    """
+    original = woven = 0
+    for item in job_data:
+        slot = chunker.job_slot(item, lang)
+        if slot["status"] == "completed" and slot.get("translated_text"):
+            original += len(item["original_text"])
+            woven += len(slot["translated_text"])
+    if not original:
+        return MARKUP_RATIO
+    return max(0.0, woven / original - 1)
+
+def estimate_chunks(job_data, target_lang, known_words, new_word_rate = NEW_WORD_RATE):
+    """
+    Returns one estimate per pending chunk (of target_lang, in a multi-language job), in job order:
+    {'id', 'input_tokens', 'output_tokens', 'vocabulary', 'new_words'}
+    The known-words list sent with each request grows by the projected new words.
+    """
+    prompt_tokens = estimate_tokens(weaver.build_prompt(target_lang))
+    vocab_chars = len(json.dumps(known_words, ensure_ascii = False))
+    vocabulary = len(known_words)
+    lang = target_lang if chunker.job_languages(job_data) else None
+    ratio = markup_ratio(job_data, lang)
+    # Average size of one more lemma in the JSON list: the word plus quotes, comma and space
+    avg_lemma_chars = vocab_chars / vocabulary if vocabulary else 8
+
+    estimates = []
+    for item in job_data:
+        if chunker.job_slot(item, lang)["status"] != "pending":
+            continue
+        text = item["original_text"]
+        new_words = round(len(text.split()) * new_word_rate)
+
+        input_tokens = prompt_tokens + estimate_tokens(text) + round(vocab_chars / CHARS_PER_TOKEN)
+        output_chars = len(text) * (1 + ratio) + new_words * avg_lemma_chars
+        estimates.append({
+            "id": item["id"],
+            "input_tokens": input_tokens,
+            "output_tokens": round(output_chars / CHARS_PER_TOKEN),
+            "vocabulary": vocabulary,
+            "new_words": new_words,
+        })
+
+        # The next request carries the grown vocabulary
+        vocabulary += new_words
+        vocab_chars += new_words * avg_lemma_chars
+    return estimates
+
+def simulate_time(estimates, concurrency = 1, rpm = None, pause = 8, ttft = 2.0, tokens_per_second = 150):
+    """
+    Event simulation of the wall-clock time for the estimated calls.
+    concurrency: parallel workers. rpm: requests per minute limit (None for no limit).
+    pause: sleep after each call (process_job uses 8s). Latency = ttft + output_tokens / tokens_per_second.
+    """
+    workers = [0.0] * concurrency      # Time at which each worker is free again
+    heapq.heapify(workers)
+    starts = deque()                   # Start times inside the last minute, for the rpm limit
+    finished = 0.0
+
+    for estimate in estimates:
+        start = heapq.heappop(workers)
+        if rpm:
+            while starts and starts[0] <= start - 60:
+                starts.popleft()
+            if len(starts) >= rpm:
+                start = max(start, starts[-rpm] + 60)
+            starts.append(start)
+        end = start + ttft + estimate["output_tokens"] / tokens_per_second
+        finished = max(finished, end)
+        heapq.heappush(workers, end + pause)
+    return finished
+
+def plan_job(
+    job_file = "chunked_Dante - The Divine Comedy.json",
+    folder = "user",
+    target_lang = "Italian",
+    known_words_filename = None,
+    new_word_rate = NEW_WORD_RATE,
+    concurrency = 1,
+    rpm = None,
+    pause = 8,
+    ttft = 2.0,
+    tokens_per_second = 150
+):
+    """
+    Offline estimate for the pending chunks of a job.
+    Returns {'chunks': [...], 'input_tokens', 'output_tokens', 'final_vocabulary', 'seconds'}
+    known_words_filename: defaults to the language's vocabulary file.
+    """
+    job_data = jobfile.load_job(Path(folder) / job_file)
+
+    multi = bool(chunker.job_languages(job_data))
+    if multi:
+        # A language the job doesn't have yet: all of its chunks are pending (not saved)
+        chunker.add_languages(job_data, [target_lang])
+    if known_words_filename is None:
+        known_words_filename = chunker.vocab_filename(target_lang if multi else None)
+
+    words_path = Path(folder) / known_words_filename
+    known_words = []
+    if words_path.exists():
+        with open(words_path, "r", encoding="utf-8") as f:
+            known_words = json.load(f)
+
+    estimates = estimate_chunks(job_data, target_lang, known_words, new_word_rate)
+    final_vocabulary = len(known_words)
+    if estimates:
+        final_vocabulary = estimates[-1]["vocabulary"] + estimates[-1]["new_words"]
+    return {
+        "chunks": estimates,
+        "input_tokens": sum(e["input_tokens"] for e in estimates),
+        "output_tokens": sum(e["output_tokens"] for e in estimates),
+        "final_vocabulary": final_vocabulary,
+        "seconds": simulate_time(estimates, concurrency, rpm, pause, ttft, tokens_per_second),
+    }
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import threading
+import time
+
+import jobfile
+import planner
+
+
+# Context caching: the weaving instructions are the same for every chunk of a language,
+# so they are uploaded once as a cached context and each request only sends the chunk
+# (and the known words that aren't in the cache). Optionally the known-words list is
+# "frozen" into the cache too; the words learnt after that are sent with each request.
+# The prompt alone (~540 tokens) is below the API's minimum, so the known words are also
+# frozen in whenever the prompt is too small to be cached on its own.
+#
+# A cache belongs to one model and one prompt (i.e. one target language). It is replaced
+# when the vocabulary no longer starts with its frozen words, or has grown by more than
+# refreeze_words since, and its lifetime is extended before it expires.
+
+MIN_CACHE_TOKENS = 1024   # The API rejects smaller cached contexts
+
+
+def prompt_key(model, prompt):
+    return model, hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class PromptCache:
+    def __init__(self, ttl = 3600, freeze_vocabulary = False, refreeze_words = 200, min_tokens = MIN_CACHE_TOKENS):
+        """
+        ttl: lifetime of a cache in seconds (it is extended while in use)
+        freeze_vocabulary: also cache the known words, as they are when the cache is made
+        (done anyway when the prompt alone is smaller than min_tokens)
+        refreeze_words: make a new cache once this many words were learnt after freezing
+        min_tokens: don't try to cache less than this (estimated) amount
+        """
+        self.ttl = ttl
+        self.freeze_vocabulary = freeze_vocabulary
+        self.refreeze_words = refreeze_words
+        self.min_tokens = min_tokens
+        self.entries = {}   # prompt_key -> {'name', 'client', 'frozen', 'expires'}
+        self.lock = threading.Lock()
+        self.stats = {"created": 0, "hits": 0, "extended": 0, "invalidated": 0, "uncached": 0, "cached_tokens": 0}
+
+    def is_valid(self, entry, words):
+        frozen = entry["frozen"]
+        if words[:len(frozen)] != frozen:
+            return False   # Vocabulary was changed or reset
+        if entry["freeze"] and len(words) - len(frozen) > self.refreeze_words:
+            return False   # Enough new words to be worth caching them too
+        return time.time() < entry["expires"]
+
+    def should_freeze(self, prompt):
+        return self.freeze_vocabulary or planner.estimate_tokens(prompt) < self.min_tokens
+
+    def create(self, client, model, prompt, frozen):
+        contents = [prompt, frozen] if frozen else [prompt]
+        cache = client.caches.create(
+            model = model,
+            config = {
+                "contents": contents,
+                "display_name": "diglot-weave prompt",
+                "ttl": f"{self.ttl}s",
+            }
+        )
+        return {"name": cache.name, "client": client, "frozen": frozen, "expires": time.time() + self.ttl}
+
+    def delete(self, entry):
+        try:
+            entry["client"].caches.delete(name = entry["name"])
+        except Exception as e:
+            # Left behind, it is billed until it expires
+            print(f"Couldn't delete cache {entry['name']}: {e}")
+
+    def lookup(self, client, model, prompt, words):
+        """
+        Returns (cache name, known words still to send), or (None, words) to send the
+        request uncached as [prompt, text, words].
+        """
+        key = prompt_key(model, prompt)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and not self.is_valid(entry, words):
+                if time.time() < entry["expires"]:
+                    self.delete(entry)
+                del self.entries[key]
+                self.stats["invalidated"] += 1
+                entry = None
+
+            if entry is None:
+                freeze = self.should_freeze(prompt)
+                frozen = list(words) if freeze else []
+                size = planner.estimate_tokens(prompt) + planner.estimate_tokens(json.dumps(frozen, ensure_ascii = False))
+                if size < self.min_tokens:
+                    self.stats["uncached"] += 1
+                    return None, words
+                try:
+                    entry = self.create(client, model, prompt, frozen)
+                    entry["freeze"] = freeze
+                except Exception as e:
+                    print(f"Couldn't create cache, sending the prompt instead: {e}")
+                    self.stats["uncached"] += 1
+                    return None, words
+                self.entries[key] = entry
+                self.stats["created"] += 1
+                print(f"Cached the prompt{f' and {len(frozen)} known words' if frozen else ''} as {entry['name']}")
+            else:
+                self.stats["hits"] += 1
+
+            # Keep a cache that is in use alive
+            if entry["expires"] - time.time() < self.ttl / 4:
+                client.caches.update(name = entry["name"], config = {"ttl": f"{self.ttl}s"})
+                entry["expires"] = time.time() + self.ttl
+                self.stats["extended"] += 1
+            return entry["name"], words[len(entry["frozen"]):]
+
+    def add_usage(self, usage_metadata):
+        with self.lock:
+            self.stats["cached_tokens"] += getattr(usage_metadata, "cached_content_token_count", 0) or 0
+
+    def close(self):
+        """
+        Deletes the caches (they cost storage until they expire).
+        """
+        with self.lock:
+            for entry in self.entries.values():
+                if time.time() < entry["expires"]:
+                    self.delete(entry)
+            self.entries.clear()
+
+    def report(self):
+        s = self.stats
+        return (f"{s['created']} caches created, {s['hits']} requests used an existing one, "
+                f"{s['invalidated']} invalidated, {s['extended']} extended, {s['uncached']} uncached, "
+                f"{s['cached_tokens']:,} input tokens served from the cache")
+
+
+# --- BENCHMARK AGAINST THE MOCK BACKEND ---
+
+def benchmark(job_file = "chunked_Dante - The Divine Comedy.json", folder = "user", chunks = 20, vocabulary = 400):
+    """
+    Weaves the first chunks of a job uncached, cached (--cache) and with the vocabulary always
+    frozen into the cache (--freeze-vocab), on a mock backend where input takes time to process.
+    """
+    from pathlib import Path
+
+    import mock_backend
+    import weaver
+
+    texts = [item["original_text"] for item in jobfile.load_job(Path(folder) / job_file)[:chunks]]
+    prompt = weaver.build_prompt("Italian")
+    known = [f"parola{i}" for i in range(vocabulary)]
+
+    for label, cache in (("uncached    ", None), ("cached      ", PromptCache()), ("frozen vocab", PromptCache(freeze_vocabulary = True))):
+        client = mock_backend.MockClient(ttft = 0.02, tokens_per_second = 5000, prefill_tokens_per_second = 20000)
+        words = list(known)
+        input_tokens = 0
+        started = time.perf_counter()
+        for text in texts:
+            usage = {}
+            _, new_words = weaver.call_ai(prompt, text, words, client = client, usage = usage, cache = cache)
+            input_tokens += usage["input_tokens"]
+            words += [f"nuova{len(words)}"]   # The vocabulary grows with every chunk
+        seconds = time.perf_counter() - started
+        cached_tokens = cache.stats["cached_tokens"] if cache else 0
+        print(f"{label}: {seconds / len(texts) * 1000:.0f} ms per chunk, "
+              f"{input_tokens - cached_tokens:,} uncached / {cached_tokens:,} cached input tokens")
+        if cache:
+            print(f"              {cache.report()}")
+            cache.close()
+
+def main():
+    benchmark()
+
+
+if __name__ == "__main__":
+    main()
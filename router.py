@@ -0,0 +1,191 @@
+import json
+import re
+import threading
+import time
+from pathlib import Path
+
+import jobfile
+import planner
+import weaver
+
+
+# Model routing: easy chunks (headings, front matter, short plain prose) go to a cheaper,
+# faster model first. If its answer fails the local checks, the chunk is escalated to
+# the next tier. Latency, tokens and escalations are recorded per tier.
+
+TIERS = [
+    {"name": "lite", "model": "gemini-flash-lite-latest"},
+    {"name": "flash", "model": weaver.MODEL},
+]
+
+
+def chunk_features(text, known_words):
+    words = text.split()
+    sentences = [s for s in re.split(r'[.!?;:]+\s', text) if s.strip()]
+    long_words = [w for w in words if len(w.strip('.,;:!?“”"’\'()')) > 8]
+    return {
+        "chars": len(text),
+        "words": len(words),
+        "words_per_sentence": len(words) / max(1, len(sentences)),
+        "long_word_share": len(long_words) / max(1, len(words)),
+        "new_words": round(len(words) * planner.NEW_WORD_RATE),
+        "known_words": len(known_words),
+    }
+
+def difficulty(features):
+    """
+    0 (easy) .. 1 (hard): long sentences and long words make weaving harder.
+    """
+    sentence_score = min(1.0, features["words_per_sentence"] / 40)
+    word_score = min(1.0, features["long_word_share"] / 0.2)
+    return round(0.5 * sentence_score + 0.5 * word_score, 3)
+
+def check_output(original, woven, new_words, known_words):
+    """
+    Local checks on a woven chunk. Returns a list of problems (empty if it looks fine).
+    """
+    problems = []
+    if not woven.strip():
+        return ["empty output"]
+    if len(woven.split("\n\n")) != len(original.split("\n\n")):
+        problems.append("paragraph count changed")
+    tags = re.findall(r'\{([^{}]*)\}', woven)
+    if woven.count("{") != len(tags) or any(tag.count("|") != 2 for tag in tags):
+        problems.append("malformed {Word|Lemma|Original} tags")
+    ratio = len(woven) / max(1, len(original))
+    if not 0.8 <= ratio <= 2.5:
+        problems.append(f"length ratio {ratio:.2f}")
+    allowed = max(3, round(len(original.split()) * 2 * planner.NEW_WORD_RATE))
+    if len(new_words) > allowed:
+        problems.append(f"{len(new_words)} new words (allowed {allowed})")
+    used = set(weaver.woven_lemmas(woven))
+    missing = [w for w in new_words if w.lower() not in used and w not in known_words]
+    if missing:
+        problems.append(f"new words not used in the text: {', '.join(missing[:5])}")
+    return problems
+
+
+class ModelRouter:
+    def __init__(self, tiers = TIERS, max_lite_chars = 2500, max_lite_difficulty = 0.35, max_lite_new_words = 5, stats_file = None):
+        """
+        A chunk starts on the cheapest tier if it is short, easy and introduces few words;
+        otherwise it goes straight to the strongest tier.
+        stats_file: JSON file the per-tier numbers are added to (kept across runs).
+        """
+        self.tiers = tiers
+        self.max_lite_chars = max_lite_chars
+        self.max_lite_difficulty = max_lite_difficulty
+        self.max_lite_new_words = max_lite_new_words
+        self.stats_file = stats_file
+        self.lock = threading.Lock()
+        self.stats = {t["name"]: {"calls": 0, "escalations": 0, "seconds": 0.0, "input_tokens": 0, "output_tokens": 0} for t in tiers}
+
+    def pick_tier(self, text, known_words):
+        features = chunk_features(text, known_words)
+        if (features["chars"] <= self.max_lite_chars
+                and difficulty(features) <= self.max_lite_difficulty
+                and features["new_words"] <= self.max_lite_new_words):
+            return 0
+        return len(self.tiers) - 1
+
+    def record(self, tier, seconds, usage, escalated):
+        with self.lock:
+            stats = self.stats[tier["name"]]
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["input_tokens"] += usage.get("input_tokens", 0)
+            stats["output_tokens"] += usage.get("output_tokens", 0)
+            if escalated:
+                stats["escalations"] += 1
+
+    def call(self, prompt, text, words, client = None, hedger = None, cache = None):
+        """
+        Same result as weaver.call_ai, escalating through the tiers on failed checks.
+        The last tier's answer is used even if it fails the checks, and its errors are raised;
+        an error on an earlier tier (e.g. unparseable output) escalates like a failed check.
+        """
+        for index in range(self.pick_tier(text, words), len(self.tiers)):
+            tier = self.tiers[index]
+            last = index == len(self.tiers) - 1
+            usage = {}
+            started = time.perf_counter()
+            try:
+                if hedger:
+                    woven, new_words = hedger.call(weaver.call_ai, prompt, text, words, client = client, model = tier["model"], usage = usage, cache = cache)
+                else:
+                    woven, new_words = weaver.call_ai(prompt, text, words, client = client, model = tier["model"], usage = usage, cache = cache)
+            except Exception as e:
+                if last:
+                    raise
+                self.record(tier, time.perf_counter() - started, usage, escalated = True)
+                print(f"Escalating from {tier['name']}: {type(e).__name__}: {e}")
+                continue
+
+            problems = [] if last else check_output(text, woven, new_words, words)
+            self.record(tier, time.perf_counter() - started, usage, escalated = bool(problems))
+            if not problems:
+                return woven, new_words
+            print(f"Escalating from {tier['name']}: {'; '.join(problems)}")
+
+    def report(self):
+        lines = []
+        for name, s in self.stats.items():
+            if not s["calls"]:
+                continue
+            lines.append(
+                f"  {name}: {s['calls']} calls, {s['seconds'] / s['calls']:.2f}s avg, "
+                f"{s['input_tokens']:,} in / {s['output_tokens']:,} out tokens, "
+                f"{100 * s['escalations'] / s['calls']:.0f}% escalated"
+            )
+        return "\n".join(lines)
+
+    def save(self):
+        """
+        Adds this run's numbers to the stats file.
+        """
+        if not self.stats_file:
+            return
+        path = Path(self.stats_file)
+        totals = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                totals = json.load(f)
+        for name, s in self.stats.items():
+            total = totals.setdefault(name, {key: 0 for key in s})
+            for key, value in s.items():
+                total[key] = total.get(key, 0) + value
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(totals, f, indent = 2)
+
+
+# --- BENCHMARK AGAINST THE MOCK BACKEND ---
+
+def benchmark(job_file = "chunked_Dante - The Divine Comedy.json", folder = "user", chunks = 20, seed = 1):
+    """
+    Weaves the first chunks of a job with and without routing on a mock backend where the
+    lite model is faster but gets 20% of its answers wrong.
+    """
+    import mock_backend
+
+    texts = [item["original_text"] for item in jobfile.load_job(Path(folder) / job_file)[:chunks]]
+    prompt = weaver.build_prompt("Italian")
+
+    for routed in (False, True):
+        client = mock_backend.MockClient(ttft = 0.02, tokens_per_second = 5000, seed = seed,
+                                         bad_output = {TIERS[0]["model"]: 0.2}, speed = {TIERS[0]["model"]: 0.4})
+        router = ModelRouter(tiers = TIERS if routed else TIERS[-1:])
+        started = time.perf_counter()
+        failed = 0
+        for text in texts:
+            woven, new_words = router.call(prompt, text, [], client = client)
+            failed += bool(check_output(text, woven, new_words, []))
+        label = "routed  " if routed else "unrouted"
+        print(f"{label}: {time.perf_counter() - started:.2f}s, {client.calls} API calls, {failed} bad chunks kept")
+        print(router.report())
+
+def main():
+    benchmark()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+import chunker
+import jobfile
+
+
+# Fans one chunked job out to several target languages through one pool of workers.
+# Each language weaves its chunks in reading order (book order, or starting from where the
+# reader is), one at a time, because every chunk builds on the vocabulary of the one before
+# it. Different languages run side by side.
+
+def find_position(job_data, position):
+    """
+    Index of the reader's position: a chunk id, or a chapter file (its first chunk).
+    """
+    for index, item in enumerate(job_data):
+        if str(item["id"]) == str(position):
+            return index
+    for index, item in enumerate(job_data):
+        # "chapter_5.xhtml" matches "OEBPS/Text/chapter_5.xhtml" (the first such chapter)
+        if item["source_file"].endswith(position):
+            return index
+    raise ValueError(f"No chunk or chapter called {position!r} in the job")
+
+def reading_order(job_data, position = None, window = 10):
+    """
+    Splits the job's items for a reader at position into (read-ahead, backfill):
+    the chunk at position and the window - 1 after it, then the rest of the book after
+    them followed by the part before the position. Without a position: ([], book order).
+    """
+    if position is None:
+        return [], list(job_data)
+    start = find_position(job_data, position)
+    ahead = job_data[start:start + window]
+    return ahead, job_data[start + window:] + job_data[:start]
+
+def weave_chunk(item, lang, folder, client, pause, hedger = None, router = None, cache = None):
+    """
+    Runs in a worker thread. Returns (woven text, lemmas introduced by this chunk).
+    """
+    import weaver
+
+    vocab_file = chunker.vocab_filename(lang)
+    known_before = weaver.load_json(vocab_file, folder)
+    text = weaver.weave(
+        source_folder = folder,
+        en_text_filename = f"{lang}_eng_text.txt",   # Keeps each language's scratch output apart
+        target_lang = lang,
+        known_words_filename = vocab_file,
+        en_text = item["original_text"],
+        client = client,
+        hedger = hedger,
+        router = router,
+        cache = cache,
+    )
+    # weave() appends the new lemmas to the vocabulary file
+    new_words = weaver.load_json(vocab_file, folder)[len(known_before):]
+
+    # Be nice to the API
+    time.sleep(pause)
+    return text, new_words
+
+def finish_run(hedger = None, router = None, cache = None):
+    """
+    End of a weaving run: reports on the hedger, router and cache, saves the routing
+    stats and deletes the cached contexts.
+    """
+    if hedger:
+        print(f"Hedging: {hedger.report()}")
+    if router:
+        print(f"Routing:\n{router.report()}")
+        router.save()
+    if cache:
+        cache.close()
+        print(f"Context cache: {cache.report()}")
+
+def process_languages(
+    job_file = "chunked_Dante - The Divine Comedy.json",
+    languages = ("Italian", "Russian"),
+    folder = "user",
+    max_calls = 5,
+    workers = None,
+    client = None,
+    pause = 8,
+    hedger = None,
+    router = None,
+    cache = None,
+    position = None,
+    window = 10
+):
+    """
+    Weaves up to max_calls pending chunks per language.
+    workers: size of the shared pool (default: one per language).
+    hedger: a hedger.HedgedCaller shared by all languages (one latency distribution).
+    router: a router.ModelRouter shared by all languages.
+    cache: a prompt_cache.PromptCache (it keeps one cached context per language).
+    position, window: the reader's position and read-ahead window, as in main.process_job.
+    Only this (main) thread touches the job data and saves it.
+    """
+    path = Path(folder) / job_file
+    job_data = jobfile.load_job(path)
+
+    # 1. Make sure every chunk has a slot and every language a vocabulary file
+    if not chunker.job_languages(job_data):
+        # Its woven chunks don't say which language they are in, so they can't be carried over
+        raise ValueError(f"{job_file} is a single-language job; chunk it with several --lang to weave more")
+    chunker.add_languages(job_data, languages)
+    for lang in languages:
+        chunker.ensure_vocab_file(folder, lang)
+
+    # 2. Per-language queues of pending chunks: the read-ahead window, then up to max_calls more
+    ahead, backfill = reading_order(job_data, position, window)
+    queues = {}
+    for lang in languages:
+        pending = lambda items: [item for item in items if chunker.job_slot(item, lang)["status"] == "pending"]
+        queues[lang] = pending(ahead) + pending(backfill)[:max_calls]
+
+    running = {}  # future -> (item, lang)
+    failed = set()
+    with ThreadPoolExecutor(max_workers = workers or len(languages)) as pool:
+
+        def submit_next(lang):
+            if queues[lang] and lang not in failed:
+                item = queues[lang].pop(0)
+                print(f"Processing Chunk {item['id']} [{lang}] (from {item['source_file']})...")
+                running[pool.submit(weave_chunk, item, lang, folder, client, pause, hedger, router, cache)] = (item, lang)
+
+        for lang in languages:
+            submit_next(lang)
+
+        # 3. Collect results as they finish and keep every language busy
+        while running:
+            done, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in done:
+                item, lang = running.pop(future)
+                try:
+                    text, new_words = future.result()
+                except Exception as e:
+                    print(f"Error on Chunk {item['id']} [{lang}]: {e}")
+                    failed.add(lang)  # Stop this language so you can fix the error
+                    continue
+
+                slot = chunker.job_slot(item, lang)
+                slot["translated_text"] = text
+                slot["status"] = "completed"
+                slot["new_words"] = new_words
+
+                # SAVE IMMEDIATELY (Checkpointing)
+                jobfile.save_job(path, job_data)
+                print(f"Chunk {item['id']} [{lang}] saved.")
+
+                submit_next(lang)
+
+    finish_run(hedger, router, cache)
+    print("Job finished or stopped.")
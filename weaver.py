@@ -1,9 +1,9 @@
-from google import genai
-from google.genai import types
 from pydantic import BaseModel
 from pathlib import Path
 import json
+import re
 import sys
+import time
 
 
 class Output(BaseModel):
@@ -11,6 +11,9 @@ class Output(BaseModel):
     new_words: list[str]
 
 
+MODEL = "gemini-3-flash-preview"   # "gemini-flash-latest", "gemini-3-flash-preview"
+
+
 
 #Opens json file containing the known words
 ## NEED TO FIX ERROR WHEN FILE IS EMPTY/NON-EXISTENT
@@ -37,6 +40,7 @@ def load_json(filename,folder):
 
 #Pull the list of models, not part of the program
 def get_model_list():
+    from google import genai
     client = genai.Client()
     print("List of models that support text generation: \n")
     for m in client.models.list():
@@ -87,23 +91,163 @@ def pull_data(text_filename,words_filename,folder):
 
 # It is configured to output a json with two parts - the modified text and the new words
 
-def call_ai(prompt, text, words):
+def get_client(client = None, timeout = None):
+    # Pass a client (e.g. mock_backend.MockClient) to use it instead of Gemini
+    if client is not None:
+        return client
+    #Initialise the client (imported here so the rest of the module loads quickly)
+    from google import genai
+    if timeout:
+        # Seconds; a hung request then fails instead of blocking its thread forever
+        return genai.Client(http_options = {"timeout": int(timeout * 1000)})
+    return genai.Client()
+
+def build_request(prompt, text, words, client, model, cache = None):
+    """
+    Returns (contents, config) for a weaving request.
+    cache: a prompt_cache.PromptCache; the prompt (and frozen known words) then come from a cached context.
+    """
+    config = {
+        "response_mime_type": "application/json",
+        "response_schema": Output,
+    }
+    if cache:
+        cache_name, words = cache.lookup(client, model, prompt, words)
+        if cache_name:
+            config["cached_content"] = cache_name
+            return [text, words], config
+    return [prompt, text, words], config
+
+def call_ai(prompt, text, words, client = None, model = MODEL, usage = None, cache = None):
+    """
+    usage: optional dict, filled with the request's input_tokens and output_tokens.
+    cache: optional prompt_cache.PromptCache for the static prompt.
+    """
     
     print("Generating new text...\n") 
     
-    #Initialise the client
-    client = genai.Client()
-    
+    client = get_client(client)
+    contents, config = build_request(prompt, text, words, client, model, cache)
     
     response_raw = client.models.generate_content(
-        model="gemini-3-flash-preview",                  # "gemini-flash-latest", "gemini-3-flash-preview"
-        contents=[prompt, text, words],
-        config = {
-            "response_mime_type": "application/json",
-            "response_schema": Output,
-        }
+        model=model,
+        contents=contents,
+        config = config
     )
     response = response_raw.parsed
+    if usage is not None and response_raw.usage_metadata:
+        usage["input_tokens"] = response_raw.usage_metadata.prompt_token_count or 0
+        usage["output_tokens"] = response_raw.usage_metadata.candidates_token_count or 0
+    if cache and response_raw.usage_metadata:
+        cache.add_usage(response_raw.usage_metadata)
+    return response.modified_text, response.new_words
+
+
+# --- STREAMING ---
+
+class StreamParser:
+    """
+    Incrementally reads the structured JSON reply as it streams in.
+    modified_text holds as much of the "modified_text" string as has been decoded so far.
+    """
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self):
+        self.raw = ""
+        self.modified_text = ""
+        self.done = False   # True once the closing quote of modified_text has been seen
+        self.pos = None     # Read position inside self.raw (None until the value starts)
+
+    def feed(self, piece):
+        self.raw += piece
+        if self.done:
+            return
+        if self.pos is None:
+            start = re.search(r'"modified_text"\s*:\s*"', self.raw)
+            if not start:
+                return
+            self.pos = start.end()
+
+        out = []
+        raw, i = self.raw, self.pos
+        while i < len(raw):
+            char = raw[i]
+            if char == '"':
+                self.done = True
+                i += 1
+                break
+            if char != '\\':
+                out.append(char)
+                i += 1
+                continue
+            # Escape sequence: wait for the rest of it if it was split across pieces
+            if i + 1 >= len(raw):
+                break
+            code = raw[i + 1]
+            if code != 'u':
+                out.append(self.ESCAPES.get(code, code))
+                i += 2
+                continue
+            if i + 6 > len(raw):
+                break
+            point = int(raw[i + 2:i + 6], 16)
+            if 0xD800 <= point < 0xDC00:
+                # Surrogate pair, needs the second half too
+                if i + 12 > len(raw):
+                    break
+                low = int(raw[i + 8:i + 12], 16)
+                out.append(chr(0x10000 + ((point - 0xD800) << 10) + (low - 0xDC00)))
+                i += 12
+            else:
+                out.append(chr(point))
+                i += 6
+        self.modified_text += "".join(out)
+        self.pos = i
+
+def completed_paragraphs(text):
+    """
+    The part of a partial output made of whole paragraphs (everything before the last double newline).
+    """
+    if "\n\n" not in text:
+        return ""
+    return text[:text.rindex("\n\n")]
+
+def woven_lemmas(text):
+    # Lemmas used in {Word|Lemma|Original} tags
+    return [m.group(2).strip().lower() for m in re.finditer(r'\{([^{}|]*)\|([^{}|]*)\|[^{}]*\}', text)]
+
+def call_ai_stream(prompt, text, words, client = None, on_progress = None, cache = None):
+    """
+    Same as call_ai, but consumes the response as it is generated.
+    on_progress(modified_text_so_far) is called for every streamed piece.
+    """
+    print("Generating new text (streaming)...\n")
+    client = get_client(client)
+    contents, config = build_request(prompt, text, words, client, MODEL, cache)
+
+    started = time.perf_counter()
+    first_token = None
+    parser = StreamParser()
+
+    stream = client.models.generate_content_stream(
+        model=MODEL,
+        contents=contents,
+        config = config
+    )
+    for piece in stream:
+        if cache and piece.usage_metadata:
+            cache.add_usage(piece.usage_metadata)
+        if not piece.text:
+            continue
+        if first_token is None:
+            first_token = time.perf_counter() - started
+            print(f"First token after {first_token:.2f}s")
+        parser.feed(piece.text)
+        if on_progress:
+            on_progress(parser.modified_text)
+
+    print(f"Stream finished after {time.perf_counter() - started:.2f}s")
+    response = Output.model_validate_json(parser.raw)
     return response.modified_text, response.new_words
     
 
@@ -124,18 +268,38 @@ def save_data(text_filename, words_filename, words, response_text, response_word
 
 
 
+def build_prompt(target_lang):
+    # The static weaving instructions, identical for every chunk of a language
+    return f"The aim is to create a diglot weave based on a list of known words, and slowly introduce new words in the target language (similar to Prismatext). An English text has been provided. Also a list of known {target_lang} words (as lemmas) has been provided. Replace words or phrases from the text with their {target_lang} equivalents found in the list of known words. A literal or word-for word translation will not succeed, so when you notice that it is appropriate to add a {target_lang} word, ALTER THE SENTENCE STRUCTURE AS NEEDED to make it grammatically correct (or as close as possible) in both languages (e.g. adjectives coming after nouns in some European languages). Further, multiple words may be replaced by a single word in the target language or vice versa (e.g. in Russian 'a car' becomes 'машина', not 'a машина', 'have been' becomes 'были', 'to go' becomes 'идти', etc. All of these little grammatical rules that don't translate literally between the languages). If a word/lemma is known, it should appear in all appropriate instances, with correct inflection, conjugation, gender, and any other grammatical rules not found in English. Gradually (meaning at a rate of LESS THAN 1% OF ALL WORDS) introduce new {target_lang} words (EASIEST/SIMPLEST, MOST COMMON/EVERYDAY WORDS COME FIRST) into the text, and update the list of known words. Ensure that grammar, punctuation and capitalisation are consistent with rules in both English and {target_lang}. If/when a clause contains mostly words that are known, restructure it as a {target_lang} sentence (in terms of grammar, word order etc.) rather than retaining any of the original English structure. Return 2 objects. 1. The new text (which will be a hybrid of English and Russian). Retain input formatting and include a double newline in between paragraphs (if not already present). When introducing a {target_lang} word, it MUST be in the format {{{target_lang}Word|Lemma|Original Word(s)}} with no additional emphasis or all-caps for the Russian word and the lemma in lower-case. Beyond this, no additional formatting. No emphasising the {target_lang} words with asterisks or all caps. And 2. Return the list of newly added {target_lang} lemmas."
+
+
 def weave(
     source_folder = "user",
     en_text_filename = "eng_text.txt",
     target_lang = "Russian",
     known_words_filename = "known_words.json",
-    en_text = ""
+    en_text = "",
+    client = None,
+    stream = False,
+    partial_text = "",
+    on_progress = None,
+    hedger = None,
+    router = None,
+    cache = None
 ):
+    """
+    stream: use call_ai_stream. on_progress(woven_text_so_far) is called as text arrives.
+    partial_text: woven output of an earlier, interrupted call. Its complete paragraphs
+    are kept and only the remaining paragraphs are sent again.
+    hedger: a hedger.HedgedCaller; slow (non-streamed) calls are then duplicated.
+    router: a router.ModelRouter, to try a cheaper model first (non-streamed calls).
+    cache: a prompt_cache.PromptCache, to send the prompt as a cached context.
+    """
     
 
     #Initialise variables 
     known_words = []
-    ai_prompt = f"The aim is to create a diglot weave based on a list of known words, and slowly introduce new words in the target language (similar to Prismatext). An English text has been provided. Also a list of known {target_lang} words (as lemmas) has been provided. Replace words or phrases from the text with their {target_lang} equivalents found in the list of known words. A literal or word-for word translation will not succeed, so when you notice that it is appropriate to add a {target_lang} word, ALTER THE SENTENCE STRUCTURE AS NEEDED to make it grammatically correct (or as close as possible) in both languages (e.g. adjectives coming after nouns in some European languages). Further, multiple words may be replaced by a single word in the target language or vice versa (e.g. in Russian 'a car' becomes 'машина', not 'a машина', 'have been' becomes 'были', 'to go' becomes 'идти', etc. All of these little grammatical rules that don't translate literally between the languages). If a word/lemma is known, it should appear in all appropriate instances, with correct inflection, conjugation, gender, and any other grammatical rules not found in English. Gradually (meaning at a rate of LESS THAN 1% OF ALL WORDS) introduce new {target_lang} words (EASIEST/SIMPLEST, MOST COMMON/EVERYDAY WORDS COME FIRST) into the text, and update the list of known words. Ensure that grammar, punctuation and capitalisation are consistent with rules in both English and {target_lang}. If/when a clause contains mostly words that are known, restructure it as a {target_lang} sentence (in terms of grammar, word order etc.) rather than retaining any of the original English structure. Return 2 objects. 1. The new text (which will be a hybrid of English and Russian). Retain input formatting and include a double newline in between paragraphs (if not already present). When introducing a {target_lang} word, it MUST be in the format {{{target_lang}Word|Lemma|Original Word(s)}} with no additional emphasis or all-caps for the Russian word and the lemma in lower-case. Beyond this, no additional formatting. No emphasising the {target_lang} words with asterisks or all caps. And 2. Return the list of newly added {target_lang} lemmas."
+    ai_prompt = build_prompt(target_lang)
     output_text = ""
     output_words = []
     new_text_filename = f"woven_{en_text_filename}"
@@ -148,8 +312,34 @@ def weave(
         en_text, known_words = pull_data(en_text_filename,known_words_filename,source_folder)
     else:
         known_words = load_json(known_words_filename,source_folder)
+    # Resume: keep the paragraphs that were already woven (partial_text only holds whole ones)
+    kept_text = partial_text.rstrip()
+    kept_words = []
+    if kept_text and len(kept_text.split("\n\n")) >= len(en_text.split("\n\n")):
+        kept_text = ""  # Paragraphs don't line up with the source, start over
+    if kept_text:
+        done = len(kept_text.split("\n\n"))
+        en_text = "\n\n".join(en_text.split("\n\n")[done:])
+        # Words introduced in the kept part count as known from here on
+        kept_words = [w for w in dict.fromkeys(woven_lemmas(kept_text)) if w not in known_words]
+        print(f"Resuming after {done} woven paragraphs")
+    words_for_call = known_words + kept_words
+
     # LLM does its thing
-    output_text, output_words = call_ai(ai_prompt,en_text,known_words)
+    if stream:
+        def progress(text_so_far):
+            if on_progress:
+                on_progress(kept_text + "\n\n" + text_so_far if kept_text else text_so_far)
+        output_text, output_words = call_ai_stream(ai_prompt,en_text,words_for_call, client = client, on_progress = progress, cache = cache)
+    elif router:
+        output_text, output_words = router.call(ai_prompt, en_text, words_for_call, client = client, hedger = hedger, cache = cache)
+    elif hedger:
+        output_text, output_words = hedger.call(call_ai, ai_prompt, en_text, words_for_call, client = client, cache = cache)
+    else:
+        output_text, output_words = call_ai(ai_prompt,en_text,words_for_call, client = client, cache = cache)
+    if kept_text:
+        output_text = kept_text + "\n\n" + output_text
+        output_words = kept_words + output_words
     # Save the data to file 
     save_data(new_text_filename, known_words_filename, known_words, output_text, output_words, source_folder)
     return output_text